@@ -17,28 +17,17 @@ const EVENT_MASTER_SHEET = 'Event_Master';
 const NCC_DATA_SHEETS = ['1st Year', '2nd Year', '3rd Year'];
 /**
  * ONE-CLICK SETUP: Run this function once to set up all automation.
+ *
+ * Event_Strength and Attendance are now written by the backend export job
+ * (backend/export_sheets.py, scheduled via SHEETS_EXPORT_INTERVAL), which
+ * only pushes rows touched since its last run. This now just clears the old
+ * time-based triggers; the functions below remain for manual runs.
  */
 function setupTriggers() {
     // Clear existing triggers to avoid duplicates
     const triggers = ScriptApp.getProjectTriggers();
     triggers.forEach(t => ScriptApp.deleteTrigger(t));
-    // 1. Live Strength Update -> Every 5 Minutes
-    ScriptApp.newTrigger('updateEventStrength')
-        .timeBased()
-        .everyMinutes(5)
-        .create();
-    // 2. Process Attendance Sheet -> Daily at 1 AM
-    ScriptApp.newTrigger('processAttendanceSheet')
-        .timeBased()
-        .atHour(1)
-        .everyDays(1)
-        .create();
-    // 2.1 Also run it every hour during the day to keep it relatively fresh?
-    ScriptApp.newTrigger('processAttendanceSheet')
-        .timeBased()
-        .everyHours(1)
-        .create();
-    Logger.log("Triggers set up successfully.");
+    Logger.log("Triggers cleared. Derived sheets are exported by the backend.");
 }
 /**
  * 1. LIVE UPDATE: Process new logs to update Event Strength
@@ -0,0 +1,157 @@
+from sqlalchemy import text
+from database import engine
+from datetime import date
+import os
+
+# Moves attendance logs of closed terms out of attendance_logs into
+# attendance_logs_archive and keeps per-cadet counts for each archived term
+# in attendance_term_rollups. attendance_logs (and so attendance_summary_view
+# and the dashboards) then only holds the current term; per-event lookups and
+# exports read the attendance_logs_all view, and /attendance-summary?term=
+# serves the rollups.
+#
+# A term is an academic year starting in TERM_START_MONTH, named '2024-25'.
+# Run after a term ends, e.g. from cron:
+#   python archive_attendance.py archive --vacuum
+
+TERM_START_MONTH = int(os.getenv("TERM_START_MONTH", "7")) # July
+
+def term_for(d):
+    start_year = d.year if d.month >= TERM_START_MONTH else d.year - 1
+    return f"{start_year}-{(start_year + 1) % 100:02d}"
+
+def term_bounds(term):
+    """
+    [start, end) dates of a term name like '2024-25'.
+    """
+    start_year = int(term.split("-")[0])
+    return date(start_year, TERM_START_MONTH, 1), date(start_year + 1, TERM_START_MONTH, 1)
+
+# Same categories as attendance_summary_view (create_view.py)
+ROLLUP_SQL = """
+INSERT INTO attendance_term_rollups
+    (term, enrollment_id, mandatory_parade, social_drives, college_events, others, total)
+SELECT
+    :term,
+    a.enrollment_id,
+    COUNT(CASE WHEN (LOWER(e.event_type) LIKE '%mandatory%' OR LOWER(e.event_type) LIKE '%parade%') AND a.status IS NOT NULL THEN 1 END),
+    COUNT(CASE WHEN LOWER(e.event_type) LIKE '%social%' AND a.status IS NOT NULL THEN 1 END),
+    COUNT(CASE WHEN LOWER(e.event_type) LIKE '%college%' AND a.status IS NOT NULL THEN 1 END),
+    COUNT(CASE WHEN
+        (LOWER(e.event_type) NOT LIKE '%mandatory%'
+         AND LOWER(e.event_type) NOT LIKE '%parade%'
+         AND LOWER(e.event_type) NOT LIKE '%social%'
+         AND LOWER(e.event_type) NOT LIKE '%college%')
+        AND a.status IS NOT NULL THEN 1 END),
+    COUNT(a.id)
+FROM attendance_logs_archive a
+LEFT JOIN events e ON a.event_id = e.event_id
+WHERE a.term = :term
+GROUP BY a.enrollment_id
+"""
+
+TERM_EVENTS_SQL = "SELECT event_id FROM events WHERE date >= :start AND date < :end"
+
+def hot_terms(conn):
+    """
+    {term: log count} for logs still in attendance_logs.
+    """
+    rows = conn.execute(text("""
+        SELECT e.date, COUNT(*) FROM attendance_logs l
+        JOIN events e ON l.event_id = e.event_id
+        GROUP BY e.date
+    """))
+    terms = {}
+    for d, count in rows:
+        if d is None:
+            continue
+        d = date.fromisoformat(d) if isinstance(d, str) else d
+        terms[term_for(d)] = terms.get(term_for(d), 0) + count
+    return terms
+
+def closed_terms(conn, today=None):
+    current = term_for(today or date.today())
+    return sorted(t for t in hot_terms(conn) if t < current)
+
+def archive_term(term, dry_run=False):
+    """
+    Moves one term's logs to the archive and rebuilds its rollup, in one
+    transaction. Safe to re-run: late logs (journal flushes, Sheets syncs)
+    are moved on the next run and the rollup is recomputed from the archive.
+    """
+    if term >= term_for(date.today()):
+        print(f"{term} is not closed yet, skipping.")
+        return 0
+    start, end = term_bounds(term)
+    params = {"term": term, "start": start, "end": end}
+    with engine.begin() as conn:
+        count = conn.execute(text(
+            f"SELECT COUNT(*) FROM attendance_logs WHERE event_id IN ({TERM_EVENTS_SQL})"), params).scalar()
+        if dry_run:
+            print(f"{term}: would archive {count} logs.")
+            return count
+
+        conn.execute(text(f"""
+            INSERT INTO attendance_logs_archive (id, event_id, enrollment_id, status, timestamp, term)
+            SELECT id, event_id, enrollment_id, status, timestamp, :term
+            FROM attendance_logs WHERE event_id IN ({TERM_EVENTS_SQL})
+            ON CONFLICT DO NOTHING
+        """), params)
+        conn.execute(text(f"DELETE FROM attendance_logs WHERE event_id IN ({TERM_EVENTS_SQL})"), params)
+        conn.execute(text("DELETE FROM attendance_term_rollups WHERE term = :term"), params)
+        conn.execute(text(ROLLUP_SQL), params)
+    print(f"{term}: archived {count} logs.")
+    return count
+
+def vacuum():
+    """
+    Reclaims the space of moved rows (Postgres; VACUUM can't run in a transaction).
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM (ANALYZE) attendance_logs"))
+        conn.execute(text("ANALYZE attendance_logs_archive"))
+    print("Vacuumed attendance_logs.")
+
+def archive_closed_terms(dry_run=False, run_vacuum=False):
+    with engine.connect() as conn:
+        terms = closed_terms(conn)
+    if not terms:
+        print("No closed terms left in attendance_logs.")
+        return 0
+    total = sum(archive_term(term, dry_run=dry_run) for term in terms)
+    if run_vacuum and not dry_run and total:
+        vacuum()
+    return total
+
+def print_status():
+    with engine.connect() as conn:
+        hot = hot_terms(conn)
+        archived = dict(conn.execute(text(
+            "SELECT term, COUNT(*) FROM attendance_logs_archive GROUP BY term")).all())
+    current = term_for(date.today())
+    print(f"Current term: {current}")
+    for term in sorted(set(hot) | set(archived)):
+        print(f"  {term}: {hot.get(term, 0)} hot, {archived.get(term, 0)} archived")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Archive attendance logs of closed terms")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Log counts per term, hot and archived")
+    archive = sub.add_parser("archive", help="Archive closed terms (or one --term)")
+    archive.add_argument("--term", help="Term to archive, e.g. 2024-25")
+    archive.add_argument("--dry-run", action="store_true")
+    archive.add_argument("--vacuum", action="store_true", help="VACUUM attendance_logs afterwards")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print_status()
+    elif args.term:
+        archive_term(args.term, dry_run=args.dry_run)
+        if args.vacuum and not args.dry_run:
+            vacuum()
+    else:
+        archive_closed_terms(dry_run=args.dry_run, run_vacuum=args.vacuum)
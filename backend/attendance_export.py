@@ -0,0 +1,197 @@
+from sqlalchemy import and_, func, or_
+import numpy as np
+import pandas as pd
+import csv
+import io
+import tempfile
+import models
+
+# Cadet x event attendance matrix and the per-category summary, exported as
+# CSV or XLSX. Marks are read from one query in MARK_CHUNK_ROWS batches
+# straight into an int16 code matrix (one status code per cell), so memory
+# is bounded by cadets x events rather than by the number of marks; rows are
+# turned into strings only CHUNK_ROWS at a time while streaming.
+
+CHUNK_ROWS = 500
+MARK_CHUNK_ROWS = 50_000
+CADET_COLUMNS = ["Enrollment ID", "RANK", "Year", "Name", "DEPT", "PU ROLL NUMBER"]
+
+# Same rules as attendance_summary_view (create_view.py); an event can fall
+# in several categories, e.g. 'Social Parade'
+CATEGORIES = {
+    "mandatory_parade": ("Mandatory Parade", ["mandatory", "parade"]),
+    "social_drives": ("Social Drives", ["social"]),
+    "college_events": ("College Events", ["college"]),
+}
+OTHERS = ("others", "Others")
+CATEGORY_KEYS = list(CATEGORIES) + [OTHERS[0]]
+
+def category_filter(category):
+    event_type = func.lower(models.Event.event_type)
+    if category == OTHERS[0]:
+        return and_(*[event_type.notlike(f"%{word}%") for _, words in CATEGORIES.values() for word in words])
+    return or_(*[event_type.like(f"%{word}%") for word in CATEGORIES[category][1]])
+
+def category_flags(event_types):
+    """
+    Vectorized category membership: DataFrame of booleans, one column per
+    category key. As in the view, a NULL event type matches no category,
+    not even Others (NOT LIKE on NULL is NULL).
+    """
+    lowered = event_types.str.lower()
+    flags = pd.DataFrame({
+        key: np.logical_or.reduce([lowered.str.contains(word, regex=False, na=False) for word in words])
+        for key, (_, words) in CATEGORIES.items()
+    }, index=event_types.index)
+    flags[OTHERS[0]] = ~flags.any(axis=1) & event_types.notna()
+    return flags
+
+class AttendanceMatrix:
+    """
+    codes[i, j] indexes statuses for cadet i at event j, -1 where there is
+    no mark. A mark whose status is NULL has the code of None.
+    """
+    def __init__(self, cadets, events, codes, statuses):
+        self.cadets = cadets
+        self.events = events
+        self.codes = codes
+        self.statuses = statuses
+
+    def marked(self):
+        return self.codes >= 0
+
+    def with_status(self):
+        marked = self.marked()
+        if None in self.statuses:
+            marked &= self.codes != self.statuses.index(None)
+        return marked
+
+def fetch_matrix(db, start=None, end=None, year=None, category=None):
+    """
+    Cadets of the year, events in the date range / category, and every
+    mark between them, pivoted as the marks are read.
+    """
+    bind = db.get_bind()
+    events_query = db.query(
+        models.Event.event_id, models.Event.title, models.Event.event_type, models.Event.date
+    ).order_by(models.Event.date, models.Event.event_id)
+    if start:
+        events_query = events_query.filter(models.Event.date >= start)
+    if end:
+        events_query = events_query.filter(models.Event.date <= end)
+    if category:
+        events_query = events_query.filter(category_filter(category))
+    cadets_query = db.query(
+        models.Cadet.enrollment_id, models.Cadet.rank, models.Cadet.year, models.Cadet.name,
+        models.Cadet.department, models.Cadet.pu_roll_number
+    ).order_by(models.Cadet.enrollment_id)
+    if year:
+        cadets_query = cadets_query.filter(models.Cadet.year == year)
+
+    events = pd.read_sql(events_query.statement, bind)
+    cadets = pd.read_sql(cadets_query.statement, bind)
+    cadets.columns = CADET_COLUMNS
+
+    events_sub = events_query.order_by(None).subquery()
+    cadets_sub = cadets_query.order_by(None).subquery()
+    logs = models.AttendanceLogAll # archived terms included
+    marks_query = db.query(
+        logs.enrollment_id, logs.event_id, logs.status
+    ).join(events_sub, events_sub.c.event_id == logs.event_id) \
+     .join(cadets_sub, cadets_sub.c.enrollment_id == logs.enrollment_id)
+
+    cadet_index = pd.Index(cadets["Enrollment ID"])
+    event_index = pd.Index(events["event_id"])
+    codes = np.full((len(cadets), len(events)), -1, dtype=np.int16)
+    status_codes = {}
+    with bind.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(marks_query.statement, conn, chunksize=MARK_CHUNK_ROWS):
+            status = chunk["status"].astype(object).where(chunk["status"].notna(), None)
+            for value in status.unique():
+                status_codes.setdefault(value, len(status_codes))
+            rows = cadet_index.get_indexer(chunk["enrollment_id"])
+            cols = event_index.get_indexer(chunk["event_id"])
+            codes[rows, cols] = status.map(status_codes).to_numpy(dtype=np.int16)
+
+    return AttendanceMatrix(cadets, events, codes, list(status_codes))
+
+def build_summary(matrix):
+    """
+    attendance_summary_view columns over the matrix's events: category
+    counts are the marks-with-status matrix times the event category flags.
+    """
+    flags = category_flags(matrix.events["event_type"])
+    counts = matrix.with_status().astype(np.int32) @ flags.to_numpy(dtype=np.int32)
+
+    summary = matrix.cadets.copy()
+    summary.insert(0, "Sr No", np.arange(1, len(summary) + 1))
+    for i, key in enumerate(flags.columns):
+        summary[CATEGORIES[key][0] if key in CATEGORIES else OTHERS[1]] = counts[:, i]
+    summary["Total"] = matrix.marked().sum(axis=1)
+    return summary
+
+def event_header(event):
+    return f"{event.date} {event.title}" if event.date else str(event.title)
+
+def matrix_chunks(matrix):
+    """
+    Yields the header row, then DataFrames of CHUNK_ROWS matrix rows.
+    """
+    labels = np.array([s or "" for s in matrix.statuses] + [""], dtype=object) # code -1 maps to ""
+    events = matrix.events
+    yield CADET_COLUMNS + [event_header(e) for e in events.itertuples()] + ["Total"]
+    for start in range(0, len(matrix.cadets), CHUNK_ROWS):
+        block = matrix.codes[start:start + CHUNK_ROWS]
+        chunk = matrix.cadets.iloc[start:start + CHUNK_ROWS].reset_index(drop=True)
+        cells = pd.DataFrame(labels[block], columns=range(len(events)))
+        chunk = pd.concat([chunk, cells], axis=1)
+        chunk["Total"] = (block >= 0).sum(axis=1)
+        yield chunk
+
+def summary_chunks(summary):
+    yield list(summary.columns)
+    for start in range(0, len(summary), CHUNK_ROWS):
+        yield summary.iloc[start:start + CHUNK_ROWS]
+
+def stream_csv(chunks):
+    chunks = iter(chunks)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(next(chunks))
+    yield buffer.getvalue()
+    for chunk in chunks:
+        yield chunk.to_csv(header=False, index=False)
+
+def write_xlsx(chunks, sheet_title):
+    """
+    Writes the rows with a write-only workbook (rows go straight to the
+    temporary XML, not kept as cells) and returns the open temp file.
+    """
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_title)
+    chunks = iter(chunks)
+    sheet.append(next(chunks))
+    for chunk in chunks:
+        values = chunk.astype(object)
+        values = values.where(values.notna() & (values != ""), None)
+        for row in values.to_numpy().tolist():
+            sheet.append(row)
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+def stream_file(f, block_size=64 * 1024):
+    try:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            yield data
+    finally:
+        f.close()
+
+def export_filename(kind, start=None, end=None, year=None, category=None):
+    parts = [kind] + [str(p).replace(" ", "_") for p in (start, end, year, category) if p]
+    return "_".join(parts)
@@ -0,0 +1,248 @@
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from database import engine
+import models
+from datetime import datetime, timedelta
+import os
+import sqlite3
+import threading
+import time
+
+# Local write-ahead journal for attendance marks.
+#
+# /log_attendance and /recognize (with an event_id) append the mark to a
+# SQLite file in WAL mode and answer straight away; a background flusher
+# drains pending marks to Postgres in batches with INSERT ... ON CONFLICT DO
+# NOTHING, so a slow or unreachable database never loses a mark or stalls
+# the gate. Worker processes share the file; the (event_id, enrollment_id)
+# key makes both the journal and the flush idempotent.
+#
+# Duplicate checks are answered from the journal alone. So that marks which
+# only exist in Postgres (earlier days, Sheets syncs, other gates) count,
+# the first mark for an event loads that event's existing marks into the
+# journal in a background thread; until it finishes, a duplicate of a
+# Postgres-only mark is journaled and dropped on flush.
+
+DATA_DIR = "data"
+JOURNAL_FILE = os.path.join(DATA_DIR, "attendance_journal.db")
+FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "1")) # seconds between drains
+FLUSH_BATCH = 500
+MAX_BACKOFF = 30 # seconds, while Postgres is unreachable
+RETAIN_FLUSHED_DAYS = 2 # flushed marks kept this long for duplicate checks while the DB is down
+PRELOAD_TTL = 300 # seconds before an event's Postgres marks are loaded again
+PRELOAD_RETRY_AFTER = 10 # seconds before retrying a failed load or a missing event
+
+class UnknownCadetOrEvent(Exception):
+    pass
+
+class AttendanceJournal:
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS marks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id TEXT NOT NULL,
+                enrollment_id TEXT NOT NULL,
+                status TEXT,
+                timestamp TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending', -- pending | flushed | rejected
+                error TEXT,
+                UNIQUE (event_id, enrollment_id)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS marks_state ON marks (state, id)")
+        self._preloads = {} # event_id -> (state, monotonic expiry); state is loading | loaded | missing | failed
+        self._preloads_lock = threading.Lock()
+
+    def mark(self, event_id, enrollment_id, status, timestamp=None):
+        """
+        Journals one mark without waiting on the database. Returns
+        (new, queued): new is False if the cadet is already marked for the
+        event, queued is True while the mark is still waiting to be flushed.
+        Raises UnknownCadetOrEvent if the event is known not to exist.
+        """
+        if self.preload_event(event_id) == "missing":
+            raise UnknownCadetOrEvent(f"event {event_id} not found")
+        state = self.marked_state(event_id, enrollment_id)
+        if state is not None:
+            return False, state == "pending"
+        new = self.append(event_id, enrollment_id, status, timestamp)
+        return new, True
+
+    def preload_event(self, event_id):
+        """
+        State of the event's Postgres marks in the journal; starts loading
+        them in the background when they aren't loaded (or are stale).
+        """
+        now = time.monotonic()
+        with self._preloads_lock:
+            state, expires = self._preloads.get(event_id, (None, 0.0))
+            if state == "loading" or now < expires:
+                return state
+            self._preloads[event_id] = ("loading", 0.0)
+        threading.Thread(target=self._load_event, args=(event_id,), daemon=True).start()
+        return "loading" if state is None else state
+
+    def _load_event(self, event_id):
+        try:
+            with engine.connect() as conn:
+                exists = conn.execute(text("SELECT 1 FROM events WHERE event_id = :event_id"),
+                                      {"event_id": event_id}).first() is not None
+                rows = conn.execute(text(
+                    "SELECT enrollment_id, status, timestamp FROM attendance_logs WHERE event_id = :event_id"
+                ), {"event_id": event_id}).all() if exists else []
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO marks (event_id, enrollment_id, status, timestamp, state) "
+                    "VALUES (?, ?, ?, ?, 'flushed')",
+                    [(event_id, enrollment_id, status, str(ts or datetime.now())) for enrollment_id, status, ts in rows]
+                )
+            result = ("loaded", time.monotonic() + PRELOAD_TTL) if exists \
+                else ("missing", time.monotonic() + PRELOAD_RETRY_AFTER)
+        except Exception as e:
+            print(f"Loading marks of event {event_id} failed: {e}")
+            result = ("failed", time.monotonic() + PRELOAD_RETRY_AFTER)
+        with self._preloads_lock:
+            self._preloads[event_id] = result
+
+    def append(self, event_id, enrollment_id, status, timestamp=None, state="pending"):
+        """
+        Journals one mark. Returns False if this cadet is already marked for
+        the event; a previously rejected mark is replaced.
+        """
+        timestamp = (timestamp or datetime.now()).isoformat(sep=" ")
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO marks (event_id, enrollment_id, status, timestamp, state) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (event_id, enrollment_id) DO UPDATE SET "
+                "status = excluded.status, timestamp = excluded.timestamp, state = excluded.state, error = NULL "
+                "WHERE marks.state = 'rejected'",
+                (event_id, enrollment_id, status, timestamp, state)
+            )
+        return cur.rowcount == 1
+
+    def marked_state(self, event_id, enrollment_id):
+        """
+        'pending' or 'flushed' if the journal has this mark, else None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM marks WHERE event_id = ? AND enrollment_id = ? AND state != 'rejected'",
+                (event_id, enrollment_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def pending(self, limit=FLUSH_BATCH):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, event_id, enrollment_id, status, timestamp FROM marks "
+                "WHERE state = 'pending' ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+
+    def mark_flushed(self, ids):
+        with self._lock:
+            self._conn.executemany("UPDATE marks SET state = 'flushed' WHERE id = ?", [(i,) for i in ids])
+
+    def mark_rejected(self, mark_id, error):
+        with self._lock:
+            self._conn.execute("UPDATE marks SET state = 'rejected', error = ? WHERE id = ?", (error[:500], mark_id))
+
+    def backlog(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM marks WHERE state = 'pending'").fetchone()[0]
+
+    def rejected_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM marks WHERE state = 'rejected'").fetchone()[0]
+
+    def rejected(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT event_id, enrollment_id, status, timestamp, error FROM marks WHERE state = 'rejected' ORDER BY id"
+            ).fetchall()
+
+    def prune(self, days=RETAIN_FLUSHED_DAYS):
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat(sep=" ")
+        with self._lock:
+            self._conn.execute("DELETE FROM marks WHERE state = 'flushed' AND timestamp < ?", (cutoff,))
+
+def insert_ignore(rows):
+    """
+    INSERT ... ON CONFLICT DO NOTHING for attendance rows, in one statement.
+    """
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    stmt = insert(models.AttendanceLog).values(rows)
+    return stmt.on_conflict_do_nothing(index_elements=["event_id", "enrollment_id"])
+
+def flush_once(journal, batch=FLUSH_BATCH):
+    """
+    Drains up to one batch to the database. Returns the number of marks
+    written. Rows the database refuses (e.g. unknown cadet or event) are
+    marked rejected so they can't block the queue; connection errors
+    propagate so the caller can back off.
+    """
+    marks = journal.pending(batch)
+    if not marks:
+        return 0
+
+    rows = [{
+        "event_id": event_id,
+        "enrollment_id": enrollment_id,
+        "status": status,
+        "timestamp": datetime.fromisoformat(timestamp),
+    } for _, event_id, enrollment_id, status, timestamp in marks]
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert_ignore(rows))
+        journal.mark_flushed([m[0] for m in marks])
+        return len(marks)
+    except IntegrityError:
+        pass
+
+    # Some row violates a constraint: isolate it
+    written = 0
+    for mark, row in zip(marks, rows):
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert_ignore([row]))
+            journal.mark_flushed([mark[0]])
+            written += 1
+        except IntegrityError as e:
+            print(f"Journal: rejecting mark {row['event_id']}/{row['enrollment_id']}: {e.orig}")
+            journal.mark_rejected(mark[0], str(e.orig))
+    return written
+
+def run_flusher(journal, interval=FLUSH_INTERVAL):
+    """
+    Background loop: drain the journal, backing off while the DB is down.
+    """
+    backoff = interval
+    last_prune = 0.0
+    while True:
+        try:
+            while flush_once(journal) == FLUSH_BATCH:
+                pass
+            backoff = interval
+            if time.monotonic() - last_prune > 3600:
+                journal.prune()
+                last_prune = time.monotonic()
+        except OperationalError as e:
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            print(f"Journal flush: database unavailable, retrying in {backoff:.0f}s ({e.orig})")
+        except Exception as e:
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            print(f"Journal flush error: {e}")
+        time.sleep(backoff)
+
+def start_flusher(journal):
+    thread = threading.Thread(target=run_flusher, args=(journal,), daemon=True)
+    thread.start()
+    return thread
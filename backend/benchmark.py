@@ -0,0 +1,365 @@
+"""
+Reproducible benchmarks for recognition and attendance endpoints.
+
+    python benchmark.py match --sizes 1000 10000 100000
+    python benchmark.py db --cadets 300 --events 300 [--db-url sqlite:///bench.db]
+    python benchmark.py recognize --gallery 1000 --requests 50 [--images dir]
+    python benchmark.py load --url http://localhost:8000 --endpoint /active_event --concurrency 8 --duration 30
+    python benchmark.py all --out report.json
+
+Every mode prints (or writes with --out) a JSON report. Synthetic data is
+generated from --seed, so runs are comparable across machines and commits.
+The in-process modes point DATABASE_URL at a throwaway SQLite file unless
+--db-url is given (use a scratch Postgres database, it gets seeded).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, time as dtime, timedelta
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from gallery import Gallery
+from frame_cache import FrameCache
+
+YEARS = ["1st Year", "2nd Year", "3rd Year"]
+EVENT_TYPES = ["Mandatory Parade", "Social Service", "College Events", "Camp"]
+
+def summarize(latencies, wall_seconds=None):
+    """
+    Latency percentiles (ms) and throughput for a list of per-call seconds.
+    """
+    arr = np.asarray(latencies) * 1000
+    result = {
+        "n": int(arr.size),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "max_ms": round(float(arr.max()), 3),
+    }
+    if wall_seconds:
+        result["throughput_per_s"] = round(arr.size / wall_seconds, 2)
+    return result
+
+def timed(fn, repeat):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+# --- Synthetic data ---
+
+def synthetic_gallery(n, rng):
+    """
+    n random 128-d encodings, scaled like dlib descriptors (norm ~1).
+    """
+    enc = rng.normal(0, 1, size=(n, 128))
+    enc /= np.linalg.norm(enc, axis=1, keepdims=True)
+    return enc
+
+def perturbed_probes(gallery, count, rng, noise=0.02):
+    idx = rng.integers(0, len(gallery), size=count)
+    return idx, gallery[idx] + rng.normal(0, noise, size=(count, 128))
+
+def synthetic_face_jpegs(count, rng, size=480):
+    """
+    (jpeg, face_location) pairs: a face-sized ellipse on a noisy background
+    and its box. dlib finds no face in these, so they're posted with the box
+    (the client-localized path) to make encoding and matching actually run.
+    """
+    from PIL import Image, ImageDraw
+    frames = []
+    for _ in range(count):
+        pixels = rng.integers(0, 255, size=(size, size, 3), dtype=np.uint8)
+        img = Image.fromarray(pixels)
+        draw = ImageDraw.Draw(img)
+        cx, cy = rng.integers(size // 3, 2 * size // 3, size=2)
+        draw.ellipse([cx - 80, cy - 100, cx + 80, cy + 100], fill=(224, 172, 105))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+        frames.append((buf.getvalue(), f"{cy - 100},{cx + 80},{cy + 100},{cx - 80}"))
+    return frames
+
+def unique_frame(jpeg, i):
+    """
+    The same image with a request counter appended after the JPEG end
+    marker: decoders ignore it, but it defeats the server's frame cache.
+    """
+    return jpeg + i.to_bytes(4, "big")
+
+def recognize_form(face_location):
+    return {"face_location": face_location} if face_location else {}
+
+# --- Benchmarks ---
+
+def bench_match(sizes, repeat, rng):
+    """
+    Gallery matching the original way (compare_faces + face_distance over a
+    list of arrays), over a stacked float64 matrix, and with the quantized
+    Gallery layouts used by /recognize.
+    """
+    results = {}
+    for n in sizes:
+        gallery = synthetic_gallery(n, rng)
+        gallery_list = list(gallery)
+        _, probes = perturbed_probes(gallery, repeat, rng)
+        it = iter(probes)
+
+        def current():
+            probe = next(it)
+            matches = list(np.linalg.norm(np.asarray(gallery_list) - probe, axis=1) <= 0.6)
+            distances = np.linalg.norm(np.asarray(gallery_list) - probe, axis=1)
+            best = int(np.argmin(distances))
+            return matches[best]
+
+        stats_current = timed(current, repeat)
+        it = iter(probes)
+
+        def stacked():
+            distances = np.linalg.norm(gallery - next(it), axis=1)
+            best = int(np.argmin(distances))
+            return distances[best] <= 0.6
+
+        results[str(n)] = {
+            "list_compare_and_distance": stats_current,
+            "stacked_matrix": timed(stacked, repeat),
+            "float64_bytes": int(gallery.nbytes),
+        }
+        for dtype in ("float16", "int8"):
+            for rerank_k in (0, 5):
+                g = Gallery(gallery, dtype=dtype, rerank_k=rerank_k)
+                it = iter(probes)
+                label = f"{dtype}_rerank{rerank_k}" if rerank_k else dtype
+                results[str(n)][label] = timed(lambda: g.match(next(it)), repeat)
+                results[str(n)][f"{label}_bytes"] = g.memory_bytes()
+    return results
+
+def seed_database(engine, cadets, events, attendance_rate, rng):
+    """
+    Creates the schema and fills cadets/events/attendance_logs with
+    roster-shaped data. Returns row counts.
+    """
+    from sqlalchemy import text
+    import models
+    from create_view import ATTENDANCE_SUMMARY_VIEW_SQL, ATTENDANCE_LOGS_ALL_VIEW_SQL
+
+    views = [models.AttendanceSummary.__tablename__, models.AttendanceLogAll.__tablename__]
+    tables = [t for t in models.Base.metadata.sorted_tables if t.name not in views]
+    with engine.begin() as conn:
+        for view in views:
+            conn.execute(text(f"DROP VIEW IF EXISTS {view}"))
+    models.Base.metadata.drop_all(bind=engine, tables=tables)
+    models.Base.metadata.create_all(bind=engine, tables=tables)
+    view_sqls = [ATTENDANCE_SUMMARY_VIEW_SQL, ATTENDANCE_LOGS_ALL_VIEW_SQL]
+    if engine.dialect.name == "sqlite":
+        view_sqls = [sql.replace("CREATE OR REPLACE VIEW", "CREATE VIEW") for sql in view_sqls]
+
+    cadet_rows = [{
+        "enrollment_id": f"KA2024SDA{i:06d}",
+        "name": f"Cadet {i}",
+        "rank": "CDT",
+        "year": YEARS[i % 3],
+        "department": "SOCSE",
+        "pu_roll_number": f"2024{i:06d}",
+        "sd_sw": "SD" if i % 3 else "SW",
+    } for i in range(cadets)]
+
+    today = date.today()
+    event_rows = [{
+        "event_id": f"EVT-{i:06d}",
+        "title": f"Event {i}",
+        "event_type": EVENT_TYPES[i % len(EVENT_TYPES)],
+        "date": today - timedelta(days=events - 1 - i),
+        "time": dtime(7, 0),
+        "status": "Active" if i == events - 1 else "Ended",
+        "created_at": datetime.combine(today, dtime(0, 0)) - timedelta(days=events - 1 - i),
+    } for i in range(events)]
+
+    present = rng.random((events, cadets)) < attendance_rate
+    ev_idx, cd_idx = np.nonzero(present)
+    log_rows = [{
+        "event_id": event_rows[e]["event_id"],
+        "enrollment_id": cadet_rows[c]["enrollment_id"],
+        "status": "Present",
+        "timestamp": datetime.combine(event_rows[e]["date"], dtime(7, 30)),
+    } for e, c in zip(ev_idx.tolist(), cd_idx.tolist())]
+
+    with engine.begin() as conn:
+        conn.execute(models.Cadet.__table__.insert(), cadet_rows)
+        conn.execute(models.Event.__table__.insert(), event_rows)
+        for i in range(0, len(log_rows), 10000):
+            conn.execute(models.AttendanceLog.__table__.insert(), log_rows[i:i + 10000])
+        for view_sql in view_sqls:
+            conn.execute(text(view_sql))
+
+    return {"cadets": cadets, "events": events, "attendance_logs": len(log_rows)}
+
+def bench_db(args, rng):
+    import database
+    import main
+    from fastapi.testclient import TestClient
+
+    seeded = seed_database(database.engine, args.cadets, args.events, args.attendance_rate, rng)
+    client = TestClient(main.app)
+    endpoints = {
+        "/active_event": "/active_event",
+        "/events": "/events?limit=20",
+        "/attendance-summary": "/attendance-summary",
+        "/event_attendance": f"/event_attendance/EVT-{args.events - 1:06d}",
+        "/strength": "/strength",
+        "/cadets": "/cadets",
+    }
+    results = {}
+    for name, path in endpoints.items():
+        client.get(path)  # warm
+        results[name] = timed(lambda: client.get(path).raise_for_status(), args.repeat)
+    return {"dialect": database.engine.dialect.name, "seeded": seeded, "endpoints": results}
+
+def bench_recognize(args, rng):
+    import main
+    from fastapi.testclient import TestClient
+
+    try:
+        main.warm_up_recognition()
+    except Exception:
+        pass
+    if not main.recognition_ready.is_set():
+        return {"skipped": f"face_recognition unavailable: {main.recognition_error}"}
+
+    main.gallery = Gallery(
+        synthetic_gallery(args.gallery, rng),
+        [f"Cadet {i}" for i in range(args.gallery)],
+        [f"KA2024SDA{i:06d}" for i in range(args.gallery)],
+    )
+    if args.images:
+        # Real photos go through full detection
+        frames = [(open(os.path.join(args.images, f), "rb").read(), None)
+                  for f in sorted(os.listdir(args.images)) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+    else:
+        frames = synthetic_face_jpegs(min(args.requests, 10), rng)
+
+    # Drive uploads would dominate; benchmark the request path only. Frames
+    # repeat, so the frame cache is off to measure dlib every time.
+    main.upload_image_to_drive = lambda *a, **k: None
+    main.frame_cache = FrameCache(maxsize=0)
+    client = TestClient(main.app)
+    counter = iter(range(args.requests))
+    results = {}
+
+    def call():
+        i = next(counter)
+        jpeg, face_location = frames[i % len(frames)]
+        r = client.post("/recognize", data=recognize_form(face_location),
+                        files={"file": (f"bench_{i}.jpg", jpeg, "image/jpeg")})
+        r.raise_for_status()
+        body = r.json()
+        result = "no_face" if body.get("detail") == "No face detected" else ("match" if body.get("match") else "unknown")
+        results[result] = results.get(result, 0) + 1
+
+    report = timed(call, args.requests)
+    return {"gallery": args.gallery, "frames": len(frames), "source": args.images or "synthetic",
+            "detection": "full frame" if args.images else "client face_location",
+            "results": results, "no_face": results.get("no_face", 0), "recognize": report}
+
+def bench_load(args, rng):
+    """
+    Concurrent gate simulation against a running server: --concurrency
+    clients hammer --endpoint for --duration seconds.
+    """
+    import requests
+
+    frames = None
+    if args.endpoint.startswith("/recognize"):
+        frames = synthetic_face_jpegs(10, rng)
+    deadline = time.perf_counter() + args.duration
+
+    def client_loop(worker):
+        session = requests.Session()
+        latencies, errors, i = [], 0, 0
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            try:
+                if frames:
+                    jpeg, face_location = frames[i % len(frames)]
+                    r = session.post(args.url + args.endpoint, data=recognize_form(face_location),
+                                     files={"file": (f"load_{worker}_{i}.jpg", unique_frame(jpeg, worker << 20 | i), "image/jpeg")})
+                else:
+                    r = session.get(args.url + args.endpoint)
+                if r.status_code >= 400:
+                    errors += 1
+            except requests.RequestException:
+                errors += 1
+            latencies.append(time.perf_counter() - t)
+            i += 1
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(client_loop, range(args.concurrency)))
+    wall = time.perf_counter() - start
+
+    latencies = [l for lat, _ in outcomes for l in lat]
+    return {
+        "url": args.url, "endpoint": args.endpoint, "concurrency": args.concurrency,
+        "errors": sum(e for _, e in outcomes), **summarize(latencies, wall)
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="NCC attendance benchmarks")
+    parser.add_argument("mode", choices=["match", "db", "recognize", "load", "all"])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--db-url", help="database to seed (default: temporary SQLite file)")
+    parser.add_argument("--cadets", type=int, default=300)
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--attendance-rate", type=float, default=0.75)
+    parser.add_argument("--gallery", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--images", help="directory of real face images for 'recognize'")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="/active_event")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+
+    # Must be set before database/main are imported
+    if args.mode in ("db", "recognize", "all"):
+        os.environ["DATABASE_URL"] = args.db_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+    rng = np.random.default_rng(args.seed)
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "seed": args.seed,
+    }
+    if args.mode in ("match", "all"):
+        report["match"] = bench_match(args.sizes, args.repeat, rng)
+    if args.mode in ("db", "all"):
+        report["db"] = bench_db(args, rng)
+    if args.mode in ("recognize", "all"):
+        report["recognize"] = bench_recognize(args, rng)
+    if args.mode == "load":
+        report["load"] = bench_load(args, rng)
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+        print(f"Report written to {args.out}")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
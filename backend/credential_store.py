@@ -0,0 +1,157 @@
+from database import SessionLocal
+import models
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+# Login credentials live in the 'Credentials' sheet. They are mirrored into
+# the users table (salted PBKDF2 hashes only) and an in-memory index, so
+# /login never waits on, or fails with, the Sheets API.
+
+CREDENTIALS_SHEET = "Credentials"
+REFRESH_TTL = int(os.getenv("CREDENTIALS_TTL", "300")) # seconds between sheet refreshes
+HASH_ITERATIONS = 100_000
+
+def hash_password(password, salt):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, HASH_ITERATIONS).hex()
+
+def upsert_dialect(db):
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects import sqlite
+        return sqlite
+    from sqlalchemy.dialects import postgresql
+    return postgresql
+
+class CredentialStore:
+    def __init__(self):
+        self._users = {} # username -> {"name", "role", "salt", "password_hash", "fingerprint"}
+        self._lock = threading.Lock()
+        self._refreshing = threading.Event()
+        self._refreshed_at = 0.0
+        # Compared against when the username is unknown, so timing doesn't reveal it
+        self._dummy_salt = os.urandom(16)
+        self._dummy_hash = hash_password("", self._dummy_salt)
+        # Cheap keyed digest of each sheet password, so a refresh only runs
+        # PBKDF2 for passwords that changed; the key never leaves the process
+        self._fingerprint_key = os.urandom(32)
+
+    def fingerprint(self, password):
+        return hmac.new(self._fingerprint_key, password.encode(), hashlib.sha256).digest()
+
+    def load_from_db(self):
+        db = SessionLocal()
+        try:
+            users = {
+                u.username: {"name": u.name, "role": u.role, "salt": bytes.fromhex(u.salt), "password_hash": u.password_hash, "fingerprint": None}
+                for u in db.query(models.User).all()
+            }
+        finally:
+            db.close()
+        with self._lock:
+            self._users = users
+        print(f"Loaded {len(users)} users from DB.")
+
+    def refresh_from_sheet(self):
+        """
+        Re-reads the Credentials sheet, rehashing only passwords whose
+        fingerprint changed, and writes the result to the users table and
+        the in-memory index.
+        """
+        from google_clients import credentials_available, get_worksheet, with_retry
+        if not credentials_available():
+            print("No credentials.json found, skipping credentials refresh.")
+            return
+
+        records = with_retry(get_worksheet(CREDENTIALS_SHEET).get_all_records)
+        # An empty sheet or a renamed header must not lock everyone out
+        if not records or "Username" not in records[0]:
+            print("Credentials sheet is empty or has no 'Username' column, keeping current users.")
+            self._refreshed_at = time.monotonic()
+            return
+
+        with self._lock:
+            current = dict(self._users)
+
+        users = {}
+        for row in records:
+            username = str(row.get("Username", "")).strip()
+            if not username:
+                continue
+            password = str(row.get("Password", ""))
+            fingerprint = self.fingerprint(password)
+            known = current.get(username)
+            if known and known["fingerprint"] is not None:
+                unchanged = hmac.compare_digest(fingerprint, known["fingerprint"])
+            else:
+                # Loaded from the DB: one PBKDF2 check per user, then fingerprinted
+                unchanged = known is not None and hmac.compare_digest(hash_password(password, known["salt"]), known["password_hash"])
+            if unchanged:
+                salt, password_hash = known["salt"], known["password_hash"]
+            else:
+                salt = os.urandom(16)
+                password_hash = hash_password(password, salt)
+            users[username] = {"name": row.get("Name"), "role": row.get("Role"), "salt": salt,
+                               "password_hash": password_hash, "fingerprint": fingerprint}
+
+        db = SessionLocal()
+        try:
+            db.query(models.User).filter(models.User.username.notin_(list(users))).delete(synchronize_session=False)
+            if users:
+                # Upsert: every worker refreshes, possibly at the same time
+                rows = [{"username": username, "name": u["name"], "role": u["role"], "salt": u["salt"].hex(), "password_hash": u["password_hash"]}
+                        for username, u in users.items()]
+                stmt = upsert_dialect(db).insert(models.User).values(rows)
+                db.execute(stmt.on_conflict_do_update(
+                    index_elements=[models.User.username],
+                    set_={c: stmt.excluded[c] for c in ("name", "role", "salt", "password_hash")}
+                ))
+            db.commit()
+        finally:
+            db.close()
+
+        with self._lock:
+            self._users = users
+            self._refreshed_at = time.monotonic()
+        print(f"Refreshed {len(users)} users from Credentials sheet.")
+
+    def refresh_in_background(self):
+        """
+        Starts a sheet refresh unless one is already running.
+        """
+        if self._refreshing.is_set():
+            return
+        self._refreshing.set()
+
+        def run():
+            try:
+                self.refresh_from_sheet()
+            except Exception as e:
+                print(f"Credentials refresh failed: {e}")
+            finally:
+                self._refreshing.clear()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def verify(self, username, password):
+        """
+        Returns the user's details if the password matches, else None.
+        Kicks off a background refresh when the cache is older than the TTL.
+        """
+        if time.monotonic() - self._refreshed_at > REFRESH_TTL:
+            self.refresh_in_background()
+
+        with self._lock:
+            user = self._users.get(username)
+
+        salt, expected = (user["salt"], user["password_hash"]) if user else (self._dummy_salt, self._dummy_hash)
+        matched = hmac.compare_digest(hash_password(password, salt), expected)
+        if not user or not matched:
+            return None
+        return {"name": user["name"], "role": user["role"], "username": username}
+
+    def __len__(self):
+        return len(self._users)
+
+credential_store = CredentialStore()
@@ -0,0 +1,166 @@
+import gspread
+from google_clients import credentials_available, get_worksheet, with_retry
+from sqlalchemy import func, case
+from database import SessionLocal
+import models
+from import_data import get_high_water_mark, set_high_water_mark
+
+# Replaces the updateEventStrength / processAttendanceSheet Apps Script jobs.
+# Postgres is the source of truth; only rows touched by attendance logs newer
+# than the last exported log id are recomputed and written back.
+
+EXPORT_VERSION_KEY = "export:attendance_logs" # SyncState name, position = last exported log id
+# Log ids are handed out before commit, so a row with an id below the last
+# exported one can still commit afterwards (journal flushes, Sheets syncs).
+# The count of ids in this trailing window is stored at each export; if it
+# changed since, the window is exported again.
+EXPORT_WINDOW_KEY = "export:attendance_logs:window"
+EXPORT_ID_MARGIN = 5000
+STRENGTH_SHEET = "Event_Strength"
+ATTENDANCE_SHEET = "Attendance"
+
+def event_strength_rows(session, event_ids=None):
+    """
+    Event_Strength rows keyed by event id:
+    [Event_ID, Date, Total, 3rd Year, 2nd Year, 1st Year]
+    """
+    def year_count(y):
+        return func.count(case((models.Cadet.year == y, 1)))
+
+    query = session.query(
+        models.Event.event_id,
+        models.Event.date,
+        func.count(models.AttendanceLogAll.id),
+        year_count("3rd Year"),
+        year_count("2nd Year"),
+        year_count("1st Year"),
+    ).join(models.AttendanceLogAll, models.AttendanceLogAll.event_id == models.Event.event_id) \
+     .outerjoin(models.Cadet, models.Cadet.enrollment_id == models.AttendanceLogAll.enrollment_id) \
+     .group_by(models.Event.event_id, models.Event.date)
+    if event_ids is not None:
+        query = query.filter(models.Event.event_id.in_(event_ids))
+
+    return {
+        eid: [eid, str(d) if d else "", total, y3, y2, y1]
+        for eid, d, total, y3, y2, y1 in query
+    }
+
+def attendance_rows(session, enrollment_ids=None):
+    """
+    Attendance rows keyed by enrollment id, taken from attendance_summary_view
+    plus the rollups of archived terms:
+    [Sr No, Enrollment ID, RANK, Year, Name, DEPT, PU ROLL NUMBER,
+     Mandatory Parade, Social Drives, College Events, Others, Total]
+    """
+    rollup = models.AttendanceTermRollup
+    archived = session.query(
+        rollup.enrollment_id,
+        func.sum(rollup.mandatory_parade), func.sum(rollup.social_drives),
+        func.sum(rollup.college_events), func.sum(rollup.others), func.sum(rollup.total),
+    ).group_by(rollup.enrollment_id)
+    query = session.query(models.AttendanceSummary)
+    if enrollment_ids is not None:
+        archived = archived.filter(rollup.enrollment_id.in_(enrollment_ids))
+        query = query.filter(models.AttendanceSummary.enrollment_id.in_(enrollment_ids))
+    archived = {eid: counts for eid, *counts in archived}
+
+    rows = {}
+    for s in query:
+        counts = [s.mandatory_parade, s.social_drives, s.college_events, s.others, s.total]
+        past = archived.get(s.enrollment_id, [0] * len(counts))
+        rows[s.enrollment_id] = [
+            s.sr_no, s.enrollment_id, s.rank, s.year, s.name, s.dept, s.pu_roll_number,
+        ] + [(c or 0) + (p or 0) for c, p in zip(counts, past)]
+    return rows
+
+def window_count(session, start, end):
+    """
+    Number of attendance logs with start < id <= end.
+    """
+    return session.query(func.count(models.AttendanceLog.id)).filter(
+        models.AttendanceLog.id > start, models.AttendanceLog.id <= end).scalar()
+
+def write_rows(ws, rows, key_col):
+    """
+    Writes rows (key -> values) into the worksheet with one batch_update.
+    Existing rows are located by the key column; unknown keys are appended.
+    """
+    if not rows:
+        return 0
+
+    keys = with_retry(ws.col_values, key_col)
+    positions = {k: i + 1 for i, k in enumerate(keys) if i > 0 and k}
+    width = len(next(iter(rows.values())))
+    last_col = gspread.utils.rowcol_to_a1(1, width).rstrip("0123456789")
+
+    next_row = len(keys) + 1
+    updates = []
+    for key, values in rows.items():
+        row = positions.get(key)
+        if row is None:
+            row = next_row
+            next_row += 1
+        updates.append({"range": f"A{row}:{last_col}{row}", "values": [values]})
+
+    if next_row - 1 > ws.row_count:
+        with_retry(ws.add_rows, next_row - 1 - ws.row_count)
+    with_retry(ws.batch_update, updates, value_input_option="USER_ENTERED")
+    return len(updates)
+
+def export_sheets_data(full=False, session=None):
+    """
+    Pushes Event_Strength and Attendance to Google Sheets.
+    Only events/cadets with logs newer than the last exported version are
+    written, unless full=True.
+    """
+    own_session = session is None
+    session = session or SessionLocal()
+    print(f"--- Exporting Event_Strength & Attendance to Google Sheets ({'full' if full else 'incremental'}) ---")
+    try:
+        if not credentials_available():
+            print("No credentials.json found, skipping Sheets export.")
+            return
+
+        last_version = 0 if full else get_high_water_mark(session, EXPORT_VERSION_KEY)
+        current_version = max(session.query(func.max(models.AttendanceLog.id)).scalar() or 0, last_version)
+        window_start = max(last_version - EXPORT_ID_MARGIN, 0)
+        late_commits = not full and window_count(session, window_start, last_version) != \
+            get_high_water_mark(session, EXPORT_WINDOW_KEY)
+        if current_version <= last_version and not late_commits:
+            print("Nothing new to export.")
+            return
+        # Counted before reading the changes: a row committing after this is seen next run
+        new_window_count = window_count(session, max(current_version - EXPORT_ID_MARGIN, 0), current_version)
+
+        if full:
+            event_ids = enrollment_ids = None
+        else:
+            changed = session.query(models.AttendanceLog.event_id, models.AttendanceLog.enrollment_id).filter(
+                models.AttendanceLog.id > (window_start if late_commits else last_version),
+                models.AttendanceLog.id <= current_version
+            ).all()
+            event_ids = list({eid for eid, _ in changed})
+            enrollment_ids = list({enr for _, enr in changed})
+
+        strength = event_strength_rows(session, event_ids)
+        attendance = attendance_rows(session, enrollment_ids)
+
+        written = write_rows(get_worksheet(STRENGTH_SHEET), strength, key_col=1)
+        print(f"{STRENGTH_SHEET}: wrote {written} rows.")
+        written = write_rows(get_worksheet(ATTENDANCE_SHEET), attendance, key_col=2)
+        print(f"{ATTENDANCE_SHEET}: wrote {written} rows.")
+
+        set_high_water_mark(session, EXPORT_VERSION_KEY, current_version)
+        set_high_water_mark(session, EXPORT_WINDOW_KEY, new_window_count)
+        session.commit()
+
+    except Exception as e:
+        session.rollback()
+        print(f"Sheets export error: {e}")
+    finally:
+        if own_session:
+            session.close()
+
+if __name__ == "__main__":
+    import sys
+    export_sheets_data(full="--full" in sys.argv)
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+# Bounded LRU of face encodings keyed by the uploaded image's content, so a
+# resubmitted frame (operator retry, double registration) skips dlib entirely.
+# Encodings are cached rather than match results: matching is cheap and has
+# to see faces registered since the frame was first seen.
+#
+# Optionally a 64-bit difference hash (dHash) catches near-identical frames,
+# e.g. the same capture re-encoded by the browser. The hash is dominated by
+# the background, so main.py only uses it for /register, never to identify.
+
+CACHE_SIZE = int(os.getenv("FRAME_CACHE_SIZE", "256")) # 0 disables the cache
+PHASH_DISTANCE = int(os.getenv("FRAME_CACHE_PHASH_DISTANCE", "-1")) # max differing bits, -1 disables
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def perceptual_hash(path):
+    """
+    dHash: 9x8 grayscale thumbnail, one bit per horizontal gradient.
+    """
+    from PIL import Image
+    with Image.open(path) as img:
+        img.draft("L", (64, 64)) # JPEG: decode at reduced scale
+        pixels = list(img.convert("L").resize((9, 8)).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+class FrameCache:
+    def __init__(self, maxsize=CACHE_SIZE, phash_distance=PHASH_DISTANCE):
+        self.maxsize = maxsize
+        self.phash_distance = phash_distance
+        self._entries = OrderedDict() # (content hash, detection params) -> (phash, encodings)
+        self._lock = threading.Lock()
+
+    @property
+    def uses_phash(self):
+        return self.maxsize > 0 and self.phash_distance >= 0
+
+    def get(self, key, phash=None):
+        """
+        Returns the cached encodings for an identical frame, or for the
+        closest near-duplicate when perceptual hashing is on; else None.
+        """
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and phash is not None and self.phash_distance >= 0:
+                best = None
+                for other_key, (other_phash, _) in self._entries.items():
+                    if other_phash is None or other_key[1] != key[1]:
+                        continue
+                    distance = bin(phash ^ other_phash).count("1")
+                    if distance <= self.phash_distance and (best is None or distance < best[0]):
+                        best = (distance, other_key)
+                if best is not None:
+                    key = best[1]
+                    entry = self._entries[key]
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, encodings, phash=None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (phash, encodings)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
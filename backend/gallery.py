@@ -0,0 +1,367 @@
+import numpy as np
+import json
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows: single-process locking only
+    fcntl = None
+
+# Windows can't os.replace a file that is memory-mapped, which atomic_save
+# does on every /register; there (single worker anyway) the files are read
+# into memory instead of mapped.
+MMAP_MODE = "r" if os.name == "posix" else None
+
+# Face gallery held as a quantized matrix instead of a list of float64 arrays.
+#
+# Codes are int8 (or float16) with a per-vector scale plus precomputed
+# squared norms, so a match is one matrix-vector product:
+#   |x - p|^2 = |x|^2 - 2 * scale * (q . p) + |p|^2
+# The top-k candidates can be re-scored against the exact float32 vectors.
+#
+# SharedGallery keeps all of it in .npy files under data/ that every worker
+# process memory-maps read-only, so N workers share one copy through the
+# page cache. /register in any worker rewrites the files under a file lock
+# and bumps a generation counter (itself a mapped 8-byte file); other workers
+# compare it on each match and remap when it moves, without a restart.
+# The legacy encodings.pickle is migrated on first load and left in place.
+
+DATA_DIR = "data"
+ENCODINGS_FILE = os.path.join(DATA_DIR, "encodings.pickle")
+
+GALLERY_DTYPE = os.getenv("GALLERY_DTYPE", "int8") # int8 | float16 | float32
+RERANK_K = int(os.getenv("GALLERY_RERANK_K", "5")) # 0 disables the exact re-rank
+MATCH_TOLERANCE = 0.6 # face_recognition.compare_faces default
+CHUNK_ROWS = 8192 # bounds the float32 temporaries during matching
+
+def quantize(vectors, dtype=GALLERY_DTYPE):
+    """
+    Returns (codes, scale) with vectors ~= codes * scale[:, None].
+    """
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 128)
+    if dtype == "int8":
+        scale = np.abs(vectors).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        codes = np.round(vectors / scale[:, None]).astype(np.int8)
+        return codes, scale.astype(np.float32)
+    if dtype in ("float16", "float32"):
+        return vectors.astype(dtype), np.ones(len(vectors), dtype=np.float32)
+    raise ValueError(f"Unsupported gallery dtype: {dtype}")
+
+def dequantize(codes, scale):
+    return codes.astype(np.float32) * scale[:, None]
+
+def build_state(vectors, names, reg_nos, dtype):
+    codes, scale = quantize(vectors, dtype)
+    norms2 = (dequantize(codes, scale) ** 2).sum(axis=1)
+    return codes, scale, norms2, list(names), list(reg_nos)
+
+class Gallery:
+    """
+    In-memory gallery (benchmarks, accuracy comparisons, tests).
+    """
+    def __init__(self, vectors=None, names=None, reg_nos=None, dtype=GALLERY_DTYPE, rerank_k=RERANK_K):
+        self.dtype = dtype
+        self.rerank_k = rerank_k
+        self._lock = threading.Lock()
+        vectors = np.zeros((0, 128), dtype=np.float32) if vectors is None else np.asarray(vectors, dtype=np.float32).reshape(-1, 128)
+        # Exact float32 copy (512 B/vector) only when re-ranking reads it
+        self._exact = vectors if rerank_k > 0 else np.zeros((0, 128), dtype=np.float32)
+        # Swapped as one tuple so readers never see a half-updated gallery
+        self._state = build_state(vectors, names or [], reg_nos or [], dtype)
+
+    def __len__(self):
+        return len(self._state[0])
+
+    @property
+    def names(self):
+        return self._state[3]
+
+    @property
+    def reg_nos(self):
+        return self._state[4]
+
+    def memory_bytes(self):
+        """
+        Resident bytes: codes, scales and norms, plus the exact float32
+        vectors unless they are memory-mapped (shared via the page cache).
+        """
+        codes, scale, norms2, _, _ = self._state
+        exact = self._exact
+        resident_exact = 0 if isinstance(exact, np.memmap) else exact.nbytes
+        return int(codes.nbytes + scale.nbytes + norms2.nbytes + resident_exact)
+
+    def distances(self, probe):
+        """
+        Approximate distances from probe to every gallery entry.
+        """
+        codes, scale, norms2, _, _ = self._state
+        probe = np.asarray(probe, dtype=np.float32)
+        dots = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), CHUNK_ROWS):
+            chunk = codes[start:start + CHUNK_ROWS]
+            dots[start:start + len(chunk)] = chunk.astype(np.float32, copy=False) @ probe
+        d2 = norms2 - 2 * scale * dots + probe @ probe
+        return np.sqrt(np.maximum(d2, 0))
+
+    def exact_distances(self, probe, indices):
+        rows = np.asarray(self._exact[indices], dtype=np.float32)
+        return np.linalg.norm(rows - np.asarray(probe, dtype=np.float32), axis=1)
+
+    def match(self, probe, tolerance=MATCH_TOLERANCE):
+        """
+        Returns (index, distance) of the best entry within tolerance, else None.
+        With rerank_k > 0 the top-k approximate candidates are re-scored exactly.
+        """
+        if len(self) == 0:
+            return None
+        d = self.distances(probe)
+        if self.rerank_k > 0 and len(self._exact) >= len(d):
+            k = min(self.rerank_k, len(d))
+            candidates = np.sort(np.argpartition(d, k - 1)[:k])
+            exact = self.exact_distances(probe, candidates)
+            best = int(candidates[np.argmin(exact)])
+            distance = float(exact.min())
+        else:
+            best = int(np.argmin(d))
+            distance = float(d[best])
+        return (best, distance) if distance <= tolerance else None
+
+    def add(self, encoding, name, reg_no):
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(1, 128)
+        with self._lock:
+            codes, scale, norms2, names, reg_nos = self._state
+            new_codes, new_scale, new_norms2, _, _ = build_state(encoding, [], [], self.dtype)
+            if self.rerank_k > 0:
+                self._exact = np.concatenate([self._exact, encoding])
+            self._state = (
+                np.concatenate([codes, new_codes]),
+                np.concatenate([scale, new_scale]),
+                np.concatenate([norms2, new_norms2]),
+                names + [name],
+                reg_nos + [reg_no],
+            )
+
+class SharedGallery(Gallery):
+    """
+    File-backed gallery shared read-only between worker processes.
+    """
+    def __init__(self, data_dir=DATA_DIR, dtype=GALLERY_DTYPE, rerank_k=RERANK_K):
+        self.dtype = dtype
+        self.rerank_k = rerank_k
+        self._lock = threading.Lock()
+        self.vectors_file = os.path.join(data_dir, "gallery_encodings.npy")
+        self.meta_file = os.path.join(data_dir, "gallery_meta.json")
+        self.codes_file = os.path.join(data_dir, f"gallery_codes_{dtype}.npy")
+        self.aux_file = os.path.join(data_dir, f"gallery_aux_{dtype}.npy") # columns: scale, norm^2
+        self.generation_file = os.path.join(data_dir, "gallery.gen")
+        self.lock_file = os.path.join(data_dir, "gallery.lock")
+        self.encodings_file = os.path.join(data_dir, "encodings.pickle")
+
+        self._loaded = None
+        self._loaded_generation = None
+        with self._file_lock():
+            self._prepare_files()
+        self._generation = np.memmap(self.generation_file, dtype=np.int64, mode="r", shape=(1,))
+        self.refresh()
+
+    @contextmanager
+    def _file_lock(self):
+        with self._lock:
+            with open(self.lock_file, "a") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _prepare_files(self):
+        if not os.path.exists(self.vectors_file) and os.path.exists(self.encodings_file):
+            migrate_pickle(self.encodings_file, self.vectors_file, self.meta_file)
+        if not os.path.exists(self.vectors_file):
+            save_gallery_files(np.zeros((0, 128), dtype=np.float32), [], [], self.vectors_file, self.meta_file)
+        if self._quantized_stale():
+            # First run with this dtype, or registrations made under another
+            # dtype since: derive codes from the exact vectors
+            codes, scale, norms2, _, _ = build_state(np.load(self.vectors_file), [], [], self.dtype)
+            self._write_quantized(codes, scale, norms2)
+        if not os.path.exists(self.generation_file):
+            gen = np.memmap(self.generation_file, dtype=np.int64, mode="w+", shape=(1,))
+            gen.flush()
+            del gen
+
+    def _quantized_stale(self):
+        if not os.path.exists(self.codes_file) or not os.path.exists(self.aux_file):
+            return True
+        count = len(np.load(self.vectors_file, mmap_mode=MMAP_MODE))
+        return len(np.load(self.codes_file, mmap_mode=MMAP_MODE)) != count \
+            or len(np.load(self.aux_file, mmap_mode=MMAP_MODE)) != count
+
+    def _write_quantized(self, codes, scale, norms2):
+        atomic_save(self.codes_file, codes)
+        atomic_save(self.aux_file, np.stack([scale, norms2], axis=1).astype(np.float32))
+
+    def _bump_generation(self):
+        gen = np.memmap(self.generation_file, dtype=np.int64, mode="r+", shape=(1,))
+        gen[0] += 1
+        gen.flush()
+        del gen
+
+    def current_generation(self):
+        return int(self._generation[0])
+
+    def refresh(self):
+        """
+        Remaps the files if another process changed them since the last load.
+        """
+        generation = self.current_generation()
+        if generation == self._loaded_generation:
+            return
+        for _ in range(50):
+            exact = np.load(self.vectors_file, mmap_mode=MMAP_MODE)
+            codes = np.load(self.codes_file, mmap_mode=MMAP_MODE)
+            aux = np.load(self.aux_file, mmap_mode=MMAP_MODE)
+            with open(self.meta_file) as f:
+                meta = json.load(f)
+            consistent = len(exact) == len(codes) == len(aux) == len(meta["names"])
+            # A writer may be mid-way through replacing files; retry until they agree
+            if consistent and self.current_generation() == generation:
+                self._loaded = (exact, (codes, aux[:, 0], aux[:, 1], meta["names"], meta["reg_nos"]))
+                self._loaded_generation = generation
+                return
+            time.sleep(0.01)
+            generation = self.current_generation()
+        raise RuntimeError("Gallery files stayed inconsistent; is a writer stuck?")
+
+    @property
+    def _state(self):
+        self.refresh()
+        return self._loaded[1]
+
+    @property
+    def _exact(self):
+        return self._loaded[0]
+
+    def add(self, encoding, name, reg_no):
+        """
+        Appends one entry to the shared files and bumps the generation.
+        """
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(1, 128)
+        with self._file_lock():
+            self.refresh()
+            exact = self._exact
+            codes, scale, norms2, names, reg_nos = self._loaded[1]
+            new_codes, new_scale, new_norms2, _, _ = build_state(encoding, [], [], self.dtype)
+
+            # Quantized files first, metadata last; readers check lengths agree
+            save_gallery_files(np.concatenate([exact, encoding]), None, None, self.vectors_file, None)
+            self._write_quantized(
+                np.concatenate([codes, new_codes]),
+                np.concatenate([scale, new_scale]),
+                np.concatenate([norms2, new_norms2]),
+            )
+            save_gallery_files(None, names + [name], reg_nos + [reg_no], None, self.meta_file)
+            self._bump_generation()
+        self.refresh()
+
+def atomic_save(path, array):
+    # Write-then-rename: mapped readers keep the old inode until they remap
+    tmp = path + ".tmp.npy"
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+def save_gallery_files(vectors, names, reg_nos, vectors_file, meta_file):
+    if vectors is not None:
+        atomic_save(vectors_file, np.asarray(vectors, dtype=np.float32).reshape(-1, 128))
+    if names is not None:
+        with open(meta_file + ".tmp", "w") as f:
+            json.dump({"names": names, "reg_nos": reg_nos}, f)
+        os.replace(meta_file + ".tmp", meta_file)
+
+def migrate_pickle(encodings_file, vectors_file, meta_file):
+    with open(encodings_file, "rb") as f:
+        data = pickle.load(f)
+    names = list(data.get("names", []))
+    reg_nos = list(data.get("reg_nos") or ["Unknown"] * len(names))
+    vectors = np.asarray(data.get("encodings", []), dtype=np.float32).reshape(-1, 128)
+    save_gallery_files(vectors, names, reg_nos, vectors_file, meta_file)
+    print(f"Migrated {len(names)} faces from {encodings_file} to {vectors_file}.")
+
+def load_gallery(data_dir=DATA_DIR):
+    """
+    Opens the shared, file-backed gallery, migrating encodings.pickle if needed.
+    """
+    return SharedGallery(data_dir)
+
+def compare_accuracy(vectors, dtypes=("float32", "float16", "int8"), rerank_k=RERANK_K,
+                     tolerance=MATCH_TOLERANCE, noise=0.0, seed=0):
+    """
+    Scores each quantized layout against exact float32 matching, using every
+    enrolled vector (optionally with noise) as a probe against the others.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 128)
+    rng = np.random.default_rng(seed)
+    probes = vectors + rng.normal(0, noise, size=vectors.shape).astype(np.float32) if noise else vectors
+    n = len(vectors)
+    report = {"enrolled": n, "tolerance": tolerance, "noise": noise, "rerank_k": rerank_k}
+
+    def best_excluding_self(d, i):
+        d = d.copy()
+        d[i] = np.inf
+        j = int(np.argmin(d))
+        return j, d[j]
+
+    exact_gallery = Gallery(vectors, dtype="float32", rerank_k=0)
+    truth = [best_excluding_self(exact_gallery.distances(p), i) for i, p in enumerate(probes)]
+
+    for dtype in dtypes:
+        g = Gallery(vectors, dtype=dtype, rerank_k=0)
+        errors, top1, decisions, rerank_top1 = [], 0, 0, 0
+        for i, p in enumerate(probes):
+            approx = g.distances(p)
+            errors.append(np.abs(approx - exact_gallery.distances(p)))
+            j, dist = best_excluding_self(approx, i)
+            tj, tdist = truth[i]
+            top1 += j == tj
+            decisions += (dist <= tolerance) == (tdist <= tolerance)
+            if rerank_k:
+                masked = approx.copy()
+                masked[i] = np.inf
+                k = min(rerank_k, n - 1)
+                candidates = np.argpartition(masked, k - 1)[:k]
+                exact = np.linalg.norm(vectors[candidates] - p, axis=1)
+                rerank_top1 += int(candidates[np.argmin(exact)]) == tj
+        errors = np.concatenate(errors) if errors else np.zeros(0)
+        report[dtype] = {
+            "bytes_per_vector": round(g.memory_bytes() / max(n, 1), 1),
+            "max_abs_distance_error": round(float(errors.max()), 5) if errors.size else 0.0,
+            "mean_abs_distance_error": round(float(errors.mean()), 6) if errors.size else 0.0,
+            "top1_agreement": round(top1 / max(n, 1), 4),
+            "decision_agreement": round(decisions / max(n, 1), 4),
+        }
+        if rerank_k:
+            report[dtype]["top1_agreement_with_rerank"] = round(rerank_top1 / max(n, 1), 4)
+    return report
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare quantized gallery matching against exact float32 on the enrolled set")
+    parser.add_argument("command", choices=["compare", "migrate"])
+    parser.add_argument("--noise", type=float, default=0.0, help="gaussian noise added to probes")
+    parser.add_argument("--rerank-k", type=int, default=RERANK_K)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_pickle(ENCODINGS_FILE, os.path.join(DATA_DIR, "gallery_encodings.npy"), os.path.join(DATA_DIR, "gallery_meta.json"))
+    else:
+        g = load_gallery()
+        if len(g) < 2:
+            print("Need at least two enrolled faces to compare.")
+        else:
+            print(json.dumps(compare_accuracy(np.asarray(g._exact), rerank_k=args.rerank_k, noise=args.noise), indent=2))
@@ -0,0 +1,123 @@
+import gspread
+from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+import os
+import random
+import threading
+import time
+
+# One place that owns the Google API clients. Credentials (and their access
+# tokens) are created once per scope set and refreshed by google-auth only
+# when they expire; the gspread client keeps one keep-alive HTTP session and
+# spreadsheet/worksheet handles are cached. Drive services wrap httplib2,
+# which isn't thread-safe, so each thread gets its own service sharing the
+# same credentials.
+
+DATA_DIR = "data"
+CREDENTIALS_FILE = os.path.join(DATA_DIR, "credentials.json")
+SHEET_ID = '11yk2xohYru3MyqqnXzTYBIr3lFkWbXsVOP2P7PRDbfE'
+
+SHEETS_SCOPES = ("https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive")
+DRIVE_SCOPES = ("https://www.googleapis.com/auth/drive.file",)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+
+_lock = threading.RLock()
+_credentials = {}
+_sheets_client = None
+_spreadsheets = {}
+_worksheets = {}
+_drive = threading.local()
+_generation = 0 # bumped by reset() so per-thread Drive services get rebuilt
+
+def credentials_available():
+    return os.path.exists(CREDENTIALS_FILE)
+
+def get_credentials(scopes):
+    with _lock:
+        if scopes not in _credentials:
+            _credentials[scopes] = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=list(scopes))
+        return _credentials[scopes]
+
+def get_sheets_client():
+    global _sheets_client
+    with _lock:
+        if _sheets_client is None:
+            _sheets_client = gspread.authorize(get_credentials(SHEETS_SCOPES))
+        return _sheets_client
+
+# Handles are fetched outside _lock: with_retry can back off for a minute
+# and must not stall Drive uploads or credential lookups meanwhile. Two
+# threads may both fetch a missing handle; the first one stored wins.
+
+def get_spreadsheet(sheet_id=SHEET_ID):
+    with _lock:
+        if sheet_id in _spreadsheets:
+            return _spreadsheets[sheet_id]
+    spreadsheet = with_retry(get_sheets_client().open_by_key, sheet_id)
+    with _lock:
+        return _spreadsheets.setdefault(sheet_id, spreadsheet)
+
+def get_worksheet(name, sheet_id=SHEET_ID):
+    """
+    Cached worksheet handle. Raises gspread.exceptions.WorksheetNotFound
+    (not cached) if the tab doesn't exist.
+    """
+    key = (sheet_id, name)
+    with _lock:
+        if key in _worksheets:
+            return _worksheets[key]
+    worksheet = with_retry(get_spreadsheet(sheet_id).worksheet, name)
+    with _lock:
+        return _worksheets.setdefault(key, worksheet)
+
+def get_drive_service():
+    """
+    Per-thread Drive v3 service, or None if there are no credentials.
+    """
+    if not credentials_available():
+        return None
+    if getattr(_drive, "generation", None) != _generation:
+        try:
+            _drive.service = build('drive', 'v3', credentials=get_credentials(DRIVE_SCOPES), cache_discovery=False)
+            _drive.generation = _generation
+        except Exception as e:
+            print(f"Error creating Drive service: {e}")
+            return None
+    return _drive.service
+
+def _status_code(e):
+    if isinstance(e, gspread.exceptions.APIError):
+        return e.response.status_code
+    if isinstance(e, HttpError):
+        return e.resp.status
+    return None
+
+def with_retry(fn, *args, **kwargs):
+    """
+    Calls fn, retrying quota (429) and transient 5xx errors with
+    exponential backoff and jitter.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except (gspread.exceptions.APIError, HttpError) as e:
+            if _status_code(e) not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt, 32) + random.random()
+            print(f"Google API error {_status_code(e)}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def reset():
+    """
+    Drops all cached clients and handles (e.g. after credentials.json changes).
+    """
+    global _sheets_client, _generation
+    with _lock:
+        _credentials.clear()
+        _sheets_client = None
+        _spreadsheets.clear()
+        _worksheets.clear()
+        _generation += 1
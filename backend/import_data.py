@@ -1,19 +1,21 @@
 import pandas as pd
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from google_clients import credentials_available, get_worksheet, with_retry
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import SessionLocal
 import models
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import pickle
 import os
 
-# Setup DB
-models.Base.metadata.create_all(bind=engine)
+# Setup DB (tables are created by migrate.py)
 db = SessionLocal()
 
 # Paths
 DATA_DIR = "data"
-CREDENTIALS_FILE = os.path.join(DATA_DIR, "credentials.json")
 EXCEL_FILE = "../Sheets data/NCC Data.xlsx" # Relative to backend dir if running from there, or ABS?
 # Docker path: /app/Sheets data/NCC Data.xlsx? No, simpler to run this locally or mount.
 # User said "d:\NCC\NCC-Presi\Sheets data\NCC Data.xlsx"
@@ -23,148 +25,271 @@ EXCEL_FILE = "../Sheets data/NCC Data.xlsx" # Relative to backend dir if running
 # Actually, I'll use the absolute path provided by user if running locally?
 # Or clearer: I will read from "data/NCC Data.xlsx" and ask user to copy it there.
 
-def import_cadets():
-    print("--- Importing Cadets from Excel ---")
+# Excel header -> Cadet column
+CADET_COLUMNS = {
+    "Enrollment ID": "enrollment_id",
+    "Name": "name",
+    "RANK": "rank",
+    "DEPT": "department",
+    "PU ROLL NUMBER": "pu_roll_number",
+    "SD/SW": "sd_sw",
+    "Mobile number": "mobile_number",
+    "Email id": "email",
+    "Date of birth": "dob",
+    "Blood Group": "blood_group",
+}
+CADET_FIELDS = list(CADET_COLUMNS.values()) + ["year"]
+YEAR_SHEETS = ['3rd Year', '2nd Year', '1st Year']
+ROSTER_FILE = os.path.join(DATA_DIR, "NCC_Data.xlsx")
+
+def read_roster_sheet(xls, sheet_name):
+    """
+    Parses one year sheet into a frame of Cadet column values.
+    Only the mapped columns are read; every value is a stripped string.
+    """
+    df = pd.read_excel(xls, sheet_name=sheet_name, usecols=lambda c: c in CADET_COLUMNS, dtype=str)
+    df = df.reindex(columns=list(CADET_COLUMNS)).rename(columns=CADET_COLUMNS)
+    df = df.fillna("").apply(lambda col: col.str.strip())
+    df["year"] = sheet_name
+    df = df[df["enrollment_id"] != ""]
+    return df.drop_duplicates(subset="enrollment_id", keep="first")
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_roster(path=ROSTER_FILE):
+    """
+    Returns {sheet_name: parsed frame} for the year sheets in the workbook.
+    Parsed sheets are cached in <path>.roster.pkl, keyed by the file's
+    size/mtime (falling back to its SHA-256), so an unchanged workbook
+    is never parsed twice.
+    """
+    cache_file = path + ".roster.pkl"
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "columns": CADET_COLUMNS}
+
+    cache = None
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                cache = pickle.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable roster cache: {e}")
+
+    if cache and all(cache.get(k) == v for k, v in fingerprint.items()):
+        print("Roster unchanged, using cached parse.")
+        return cache["sheets"]
+
+    digest = file_sha256(path)
+    if cache and cache.get("sha256") == digest and cache.get("columns") == CADET_COLUMNS:
+        print("Roster content unchanged, using cached parse.")
+        sheets = cache["sheets"]
+    else:
+        sheet_names = [s for s in YEAR_SHEETS if s in pd.ExcelFile(path).sheet_names]
+        for missing in set(YEAR_SHEETS) - set(sheet_names):
+            print(f"Skipping {missing} (Not found)")
+        # openpyxl parsing is CPU bound, so sheets are parsed in separate processes
+        with ProcessPoolExecutor(max_workers=max(len(sheet_names), 1)) as pool:
+            frames = pool.map(read_roster_sheet, [path] * len(sheet_names), sheet_names)
+            sheets = dict(zip(sheet_names, frames))
+
+    try:
+        with open(cache_file, "wb") as f:
+            pickle.dump({**fingerprint, "sha256": digest, "sheets": sheets}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Could not write roster cache: {e}")
+    return sheets
+
+def fetch_existing_cadets():
+    """
+    Loads every stored cadet in one query, indexed by enrollment_id.
+    """
+    rows = db.query(*[getattr(models.Cadet, f) for f in CADET_FIELDS]).all()
+    existing = pd.DataFrame(rows, columns=CADET_FIELDS, dtype=object)
+    return existing.fillna("").set_index("enrollment_id")
+
+def diff_roster(df, existing):
+    """
+    Splits a parsed sheet into (new, changed, unchanged) frames against the stored cadets.
+    """
+    is_new = ~df["enrollment_id"].isin(existing.index)
+    current = existing.reindex(df["enrollment_id"])[CADET_FIELDS[1:]]
+    incoming = df.set_index("enrollment_id")[CADET_FIELDS[1:]]
+    differs = incoming.ne(current).any(axis=1).to_numpy()
+    is_changed = ~is_new & differs
+    return df[is_new], df[is_changed], df[~is_new & ~is_changed]
+
+def upsert_cadets(df):
+    """
+    Writes the given rows with a single INSERT ... ON CONFLICT DO UPDATE.
+    """
+    if df.empty:
+        return
+    stmt = pg_insert(models.Cadet).values(df[CADET_FIELDS].to_dict("records"))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Cadet.enrollment_id],
+        set_={f: stmt.excluded[f] for f in CADET_FIELDS[1:]}
+    )
+    db.execute(stmt)
+
+def import_cadets(dry_run=False):
+    """
+    Upserts the roster workbook into the cadets table.
+    With dry_run=True only the diff against the database is printed.
+    """
+    print(f"--- Importing Cadets from Excel{' (dry run)' if dry_run else ''} ---")
     try:
-        # Load Excel (multiple sheets)
-        xls = pd.ExcelFile("data/NCC_Data.xlsx") 
         # I will ask user to place it in backend/data/NCC_Data.xlsx to be safe inside Docker
-        
-        for sheet_name in ['3rd Year', '2nd Year', '1st Year']:
-            if sheet_name not in xls.sheet_names:
-                print(f"Skipping {sheet_name} (Not found)")
+        sheets = load_roster(ROSTER_FILE)
+
+        existing = fetch_existing_cadets()
+        seen = set()
+
+        for sheet_name, df in sheets.items():
+            # A cadet listed in more than one year sheet keeps the first (senior) entry
+            df = df[~df["enrollment_id"].isin(seen)]
+            seen.update(df["enrollment_id"])
+
+            new, changed, unchanged = diff_roster(df, existing)
+            if dry_run:
+                print_roster_diff(sheet_name, new, changed, existing)
                 continue
-                
-            df = pd.read_excel(xls, sheet_name=sheet_name)
-            # Normalize Headers
-            # Expected: Enrollment ID, Name, RANK, DEPT, PU ROLL NUMBER, etc.
-            
-            count = 0
-            for index, row in df.iterrows():
-                # Map columns safely
-                def get_val(col):
-                    val = row.get(col)
-                    return str(val).strip() if pd.notna(val) else ""
-
-                eid = get_val("Enrollment ID")
-                if not eid: continue
-
-                cadet = models.Cadet(
-                    enrollment_id=eid,
-                    name=get_val("Name"),
-                    rank=get_val("RANK"),
-                    year=sheet_name,
-                    department=get_val("DEPT"),
-                    pu_roll_number=get_val("PU ROLL NUMBER"),
-                    sd_sw=get_val("SD/SW"),
-                    mobile_number=get_val("Mobile number"),
-                    email=get_val("Email id"),
-                    dob=get_val("Date of birth"),
-                    blood_group=get_val("Blood Group")
-                )
-                
-                # Upsert
-                existing = db.query(models.Cadet).filter_by(enrollment_id=eid).first()
-                if not existing:
-                    db.add(cadet)
-                    count += 1
-            
+
+            upsert_cadets(pd.concat([new, changed]))
             db.commit()
-            print(f"Imported {count} cadets from {sheet_name}")
+            print(f"{sheet_name}: {len(new)} inserted, {len(changed)} updated, {len(unchanged)} unchanged")
 
     except Exception as e:
+        db.rollback()
         print(f"Error importing cadets: {e}")
 
-def import_sheets_data():
-    print("--- Importing Events & Logs from Google Sheets ---")
-    if not os.path.exists(CREDENTIALS_FILE):
-        print("No credentials.json found, skipping Sheets sync.")
+def print_roster_diff(sheet_name, new, changed, existing):
+    print(f"{sheet_name}: {len(new)} would be inserted, {len(changed)} would be updated")
+    for eid in new["enrollment_id"]:
+        print(f"  + {eid}")
+    if changed.empty:
         return
+    incoming = changed.set_index("enrollment_id")[CADET_FIELDS[1:]]
+    current = existing.loc[incoming.index, CADET_FIELDS[1:]]
+    for eid, row in incoming.iterrows():
+        fields = [f"{f}: {current.at[eid, f]!r} -> {row[f]!r}" for f in CADET_FIELDS[1:] if row[f] != current.at[eid, f]]
+        print(f"  ~ {eid} ({', '.join(fields)})")
 
-    try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
-        client = gspread.authorize(creds)
-        spreadsheet = client.open_by_key('11yk2xohYru3MyqqnXzTYBIr3lFkWbXsVOP2P7PRDbfE')
-        
-        # 1. Events
-        try:
-            ws = spreadsheet.worksheet("Event_Master")
-            records = ws.get_all_records()
-            count = 0
-            for row in records:
-                eid = row.get("Event ID")
-                if not eid: continue
-                
-                # Check exist
-                if db.query(models.Event).filter_by(event_id=eid).first():
-                    continue
-
-                # Parse dates
-                date_str = str(row.get("Date"))
-                time_str = str(row.get("Time"))
-                try:
-                    d = datetime.strptime(date_str, "%Y-%m-%d").date()
-                except:
-                    d = datetime.now().date() # Fallback
-                try:
-                    t = datetime.strptime(time_str, "%H:%M:%S").time() # GSheets often sends seconds
-                    # or handle %H:%M
-                except:
-                     try:
-                        t = datetime.strptime(time_str, "%H:%M").time()
-                     except:
-                        t = datetime.now().time()
-
-                event = models.Event(
-                    event_id=eid,
-                    title=row.get("Title"),
-                    event_type=row.get("Type"),
-                    date=d,
-                    time=t,
-                    status=row.get("Status", "Ended")
-                )
-                db.add(event)
-                count += 1
-            db.commit()
-            print(f"Imported {count} events.")
-        except Exception as e:
-            print(f"Events import error: {e}")
+def get_high_water_mark(session, name):
+    state = session.get(models.SyncState, name)
+    return state.position if state else 0
 
-        # 2. Logs
-        try:
-            ws = spreadsheet.worksheet("Attendance_Logs")
-            records = ws.get_all_records()
-            count = 0
-            for row in records:
-                eid = row.get("Event ID")
-                enr = row.get("Enrollment ID")
-                if not eid or not enr: continue
-                
-                # Check exist
-                if db.query(models.AttendanceLog).filter_by(event_id=eid, enrollment_id=enr).first():
-                    continue
-                    
-                log = models.AttendanceLog(
-                    event_id=eid,
-                    enrollment_id=enr,
-                    status=row.get("Status"),
-                    timestamp=datetime.now() # Approximate if timestamp parsing fails
-                )
-                # Try parse timestamp
-                ts_str = str(row.get("Timestamp"))
-                try:
-                    log.timestamp = datetime.strptime(ts_str, "%Y-%m-%d %H:%M:%S")
-                except:
-                    pass
-
-                db.add(log)
-                count += 1
-            db.commit()
-            print(f"Imported {count} logs.")
+def set_high_water_mark(session, name, position):
+    state = session.get(models.SyncState, name)
+    if not state:
+        state = models.SyncState(name=name)
+        session.add(state)
+    state.position = position
+    state.updated_at = datetime.now()
 
-        except Exception as e:
-            print(f"Logs import error: {e}")
+def fetch_rows(ws, start_row):
+    """
+    Reads the worksheet from start_row (1-based, header is row 1) to the end
+    as a frame of strings. Only that range is transferred.
+    """
+    headers = with_retry(ws.row_values, 1)
+    if not headers:
+        return pd.DataFrame()
+    last_col = gspread.utils.rowcol_to_a1(1, len(headers)).rstrip("0123456789")
+    values = with_retry(ws.get, f"A{start_row}:{last_col}")
+    rows = [list(r) + [""] * (len(headers) - len(r)) for r in values]
+    return pd.DataFrame(rows, columns=headers, dtype=str)
+
+def parse_events(df):
+    """
+    Vectorized conversion of Event_Master rows to Event column values.
+    Unparseable dates/times fall back to now, as before.
+    """
+    df = df[df["Event ID"].str.strip() != ""]
+    now = datetime.now()
+    dates = pd.to_datetime(df["Date"], format="%Y-%m-%d", errors="coerce")
+    times = pd.to_datetime(df["Time"], format="%H:%M:%S", errors="coerce")
+    times = times.fillna(pd.to_datetime(df["Time"], format="%H:%M", errors="coerce"))
+    status = df["Status"] if "Status" in df else pd.Series("Ended", index=df.index)
+    return pd.DataFrame({
+        "event_id": df["Event ID"].str.strip(),
+        "title": df["Title"],
+        "event_type": df["Type"],
+        "date": dates.fillna(pd.Timestamp(now.date())).dt.date,
+        "time": times.fillna(pd.Timestamp(now)).dt.time,
+        "status": status.replace("", "Ended"),
+    }).drop_duplicates(subset="event_id")
+
+def parse_logs(df):
+    """
+    Vectorized conversion of Attendance_Logs rows to AttendanceLog column values.
+    """
+    df = df[(df["Event ID"].str.strip() != "") & (df["Enrollment ID"].str.strip() != "")]
+    timestamps = pd.to_datetime(df["Timestamp"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    return pd.DataFrame({
+        "event_id": df["Event ID"].str.strip(),
+        "enrollment_id": df["Enrollment ID"].str.strip(),
+        "status": df["Status"],
+        "timestamp": timestamps.fillna(pd.Timestamp(datetime.now())),
+    }).drop_duplicates(subset=["event_id", "enrollment_id"])
+
+def sync_events(session, ws, start_row):
+    df = fetch_rows(ws, start_row)
+    if df.empty:
+        return 0, 0
+    events = parse_events(df)
+    existing = {eid for (eid,) in session.query(models.Event.event_id).filter(
+        models.Event.event_id.in_(events["event_id"].tolist()))}
+    events = events[~events["event_id"].isin(existing)]
+    if not events.empty:
+        stmt = pg_insert(models.Event).values(events.to_dict("records"))
+        session.execute(stmt.on_conflict_do_nothing(index_elements=[models.Event.event_id]))
+    return len(df), len(events)
+
+def sync_logs(session, ws, start_row):
+    df = fetch_rows(ws, start_row)
+    if df.empty:
+        return 0, 0
+    logs = parse_logs(df)
+    event_ids = logs["event_id"].unique().tolist()
+    # Archived terms count as imported too, or a full sync would resurrect them
+    existing = [tuple(r) for table in (models.AttendanceLog, models.AttendanceLogArchive)
+                for r in session.query(table.event_id, table.enrollment_id).filter(table.event_id.in_(event_ids))]
+    keys = pd.MultiIndex.from_frame(logs[["event_id", "enrollment_id"]])
+    logs = logs[~keys.isin(existing)]
+    if not logs.empty:
+        session.execute(models.AttendanceLog.__table__.insert(), logs.to_dict("records"))
+    return len(df), len(logs)
+
+def import_sheets_data(incremental=False, session=None):
+    """
+    Imports Event_Master and Attendance_Logs into the DB.
+    With incremental=True only rows past each worksheet's stored
+    high-water mark (rows already imported) are fetched.
+    """
+    session = session or db
+    print(f"--- Importing Events & Logs from Google Sheets ({'incremental' if incremental else 'full'}) ---")
+    if not credentials_available():
+        print("No credentials.json found, skipping Sheets sync.")
+        return
+
+    try:
+        # Events must land before logs that reference them
+        for sheet_name, sync in [("Event_Master", sync_events), ("Attendance_Logs", sync_logs)]:
+            try:
+                ws = get_worksheet(sheet_name)
+                hwm = get_high_water_mark(session, sheet_name) if incremental else 0
+                fetched, inserted = sync(session, ws, hwm + 2)
+                set_high_water_mark(session, sheet_name, hwm + fetched)
+                session.commit()
+                print(f"{sheet_name}: fetched {fetched} rows, imported {inserted}.")
+            except Exception as e:
+                session.rollback()
+                print(f"{sheet_name} import error: {e}")
 
     except Exception as e:
         print(f"Sheets sync error: {e}")
@@ -175,14 +300,14 @@ if __name__ == "__main__":
     if len(sys.argv) > 1:
         command = sys.argv[1]
         if command == "cadets":
-            import_cadets()
+            import_cadets(dry_run="--dry-run" in sys.argv)
         elif command == "sheets":
-            import_sheets_data()
+            import_sheets_data(incremental="--incremental" in sys.argv)
         else:
             print("Unknown command. Use 'cadets' or 'sheets'")
     else:
         # Default behavior (or run all)
-        print("Usage: python import_data.py [cadets|sheets]")
+        print("Usage: python import_data.py [cadets [--dry-run]|sheets [--incremental]]")
         # import_cadets()
         # import_sheets_data()
 
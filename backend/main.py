@@ -1,26 +1,38 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks, Depends
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks, Depends, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import face_recognition
-import pickle
-import numpy as np
+from starlette.concurrency import run_in_threadpool
 import os
-from datetime import datetime
-import shutil
+import re
+from datetime import datetime, date, timedelta
+from typing import Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database import engine, get_db
+from sqlalchemy import func, text
+from database import engine, get_db, SessionLocal
 import models
+from gallery import Gallery, load_gallery
+from credential_store import credential_store
+import archive_attendance
+from attendance_journal import AttendanceJournal, UnknownCadetOrEvent, start_flusher
+from frame_cache import FrameCache, content_hash, perceptual_hash
+from observability import (
+    StageTimer, get_logger, instrument_engine, metrics_middleware, metrics_payload, current_db_stats,
+    STAGE_SECONDS, RECOGNITION_RESULTS, BACKGROUND_QUEUE_DEPTH, GALLERY_SIZE, JOURNAL_BACKLOG, JOURNAL_REJECTED, FRAME_CACHE_LOOKUPS
+)
+import threading
+import time
 
-# Google API Imports
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from oauth2client.service_account import ServiceAccountCredentials
-import gspread
-
-# Create Tables
-models.Base.metadata.create_all(bind=engine)
+# Heavy stacks (dlib via face_recognition, Google APIs, pandas) are imported
+# lazily so the DB endpoints answer as soon as the process starts.
+# Schema creation lives in migrate.py.
+face_recognition = None
+recognition_ready = threading.Event()
+recognition_error = None
 
 app = FastAPI()
+logger = get_logger()
+instrument_engine(engine)
+app.middleware("http")(metrics_middleware)
 
 # CORS configuration
 app.add_middleware(
@@ -33,74 +45,308 @@ app.add_middleware(
 
 # Constants
 DATA_DIR = "data"
-ENCODINGS_FILE = os.path.join(DATA_DIR, "encodings.pickle")
-CREDENTIALS_FILE = os.path.join(DATA_DIR, "credentials.json")
+SHEETS_SYNC_INTERVAL = int(os.getenv("SHEETS_SYNC_INTERVAL", "0")) # seconds, 0 disables scheduled sync
+SHEETS_EXPORT_INTERVAL = int(os.getenv("SHEETS_EXPORT_INTERVAL", "0")) # seconds, 0 disables scheduled export
+
+# Face detection per endpoint. model is "hog" (CPU) or "cnn" (dlib CUDA build);
+# upsample finds smaller faces at a steep CPU cost; jitters re-samples the
+# face when encoding (slower, slightly more accurate encodings).
+DETECTION = {
+    endpoint: {
+        "model": os.getenv(f"{endpoint.upper()}_DETECTION_MODEL", "hog"),
+        "upsample": int(os.getenv(f"{endpoint.upper()}_UPSAMPLE", "1")),
+        "jitters": int(os.getenv(f"{endpoint.upper()}_JITTERS", "1")),
+    }
+    for endpoint in ("recognize", "register")
+}
+
+# A registration this close to an existing face is a duplicate photo: merged
+# (not stored again) for the same cadet, rejected for anyone else
+REGISTER_DUPLICATE_DISTANCE = float(os.getenv("REGISTER_DUPLICATE_DISTANCE", "0.15"))
+
+# Encodings of recently uploaded frames, so retries skip dlib (see frame_cache.py)
+frame_cache = FrameCache()
+# Near-duplicate (perceptual hash) hits only where a wrong hit is harmless: a
+# fixed gate camera gives different cadets near-identical dHashes, so
+# /recognize reuses encodings for byte-identical frames only
+PHASH_ENDPOINTS = ("register",)
 
-# Global variable to hold known faces
-known_data = {"encodings": [], "names": [], "reg_nos": []}
+# Registered faces (quantized, see gallery.py); replaced once warm-up loads it
+gallery = Gallery()
+
+# Attendance marks are journaled locally and flushed to the DB (see attendance_journal.py)
+attendance_journal = None
 
 def load_encodings():
-    global known_data
-    if os.path.exists(ENCODINGS_FILE):
-        print(f"Loading encodings from {ENCODINGS_FILE}...")
-        try:
-            with open(ENCODINGS_FILE, "rb") as f:
-                data = pickle.load(f)
-                if "reg_nos" not in data:
-                    data["reg_nos"] = ["Unknown"] * len(data["names"])
-                known_data = data
-            print(f"Loaded {len(known_data['names'])} faces.")
-        except Exception as e:
-            print(f"Error loading encodings: {e}")
-            known_data = {"encodings": [], "names": [], "reg_nos": []}
-    else:
-        print("No encodings file found. Starting with empty database.")
-        known_data = {"encodings": [], "names": [], "reg_nos": []}
+    """
+    Opens the shared gallery. A failure is raised rather than replaced by an
+    empty in-memory gallery, whose registrations would never reach disk or
+    the other workers; warm-up reports it and /recognize, /register answer 503.
+    """
+    global gallery
+    try:
+        gallery = load_gallery()
+    except Exception as e:
+        print(f"Error loading encodings: {e}")
+        raise RuntimeError(f"could not load the face gallery: {e}")
+    print(f"Loaded {len(gallery)} faces ({gallery.dtype}, {gallery.memory_bytes()} bytes).")
+
+def warm_up_recognition():
+    """
+    Loads face_recognition (dlib models) and the encodings gallery.
+    Runs in a background thread; /recognize and /register answer 503 until done.
+    """
+    global face_recognition, recognition_error
+    try:
+        print("--- WARM-UP: Loading face_recognition ---")
+        import face_recognition as fr
+        face_recognition = fr
+        print("--- WARM-UP: Loading encodings ---")
+        load_encodings()
+        recognition_ready.set()
+        print("--- WARM-UP: Recognition ready ---")
+    except Exception as e:
+        recognition_error = str(e)
+        print(f"Recognition warm-up failed: {e}")
+
+def require_recognition():
+    if not recognition_ready.is_set():
+        detail = f"Face recognition unavailable: {recognition_error}" if recognition_error else "Face recognition is warming up"
+        raise HTTPException(status_code=503, detail=detail)
 
 @app.on_event("startup")
 async def startup_event():
     print("--- STARTUP: Beginning startup_event ---")
     os.makedirs(DATA_DIR, exist_ok=True)
-    
-    print("--- STARTUP: Loading encodings ---")
-    load_encodings()
-    
-    # DB initialization happens via create_all above
-    print("--- STARTUP: Database Tables Created (if not exist) ---")
+
+    threading.Thread(target=warm_up_recognition, daemon=True).start()
+
+    print("--- STARTUP: Loading credentials ---")
+    try:
+        credential_store.load_from_db()
+    except Exception as e:
+        print(f"Error loading users from DB: {e}")
+    credential_store.refresh_in_background()
+
+    global attendance_journal
+    attendance_journal = AttendanceJournal()
+
+    # With several workers only the one holding the scheduler lock flushes
+    # the journal and runs the scheduled jobs
+    if not acquire_scheduler_lock():
+        print("--- STARTUP: Journal flusher and scheduled jobs run in another worker ---")
+    else:
+        start_flusher(attendance_journal)
+        print(f"--- STARTUP: Attendance journal flusher started ({attendance_journal.backlog()} pending) ---")
+        if SHEETS_SYNC_INTERVAL > 0:
+            threading.Thread(target=run_periodically, args=(run_sheets_sync, SHEETS_SYNC_INTERVAL), daemon=True).start()
+            print(f"--- STARTUP: Sheets sync scheduled every {SHEETS_SYNC_INTERVAL}s ---")
+        if SHEETS_EXPORT_INTERVAL > 0:
+            threading.Thread(target=run_periodically, args=(run_sheets_export, SHEETS_EXPORT_INTERVAL), daemon=True).start()
+            print(f"--- STARTUP: Sheets export scheduled every {SHEETS_EXPORT_INTERVAL}s ---")
     print("--- STARTUP: Complete ---")
 
+scheduler_lock = None
+
+def acquire_scheduler_lock():
+    global scheduler_lock
+    try:
+        import fcntl
+    except ImportError:
+        scheduler_lock = True # single process on Windows
+        return True
+    f = open(os.path.join(DATA_DIR, "scheduler.lock"), "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    scheduler_lock = f # held for the life of the process
+    return True
+
+def run_sheets_sync(incremental=True):
+    import import_data
+    db = SessionLocal()
+    try:
+        import_data.import_sheets_data(incremental=incremental, session=db)
+    finally:
+        db.close()
+
+def run_sheets_export(full=False):
+    import export_sheets
+    export_sheets.export_sheets_data(full=full)
+
+def run_periodically(job, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            job()
+        except Exception as e:
+            print(f"Scheduled {job.__name__} failed: {e}")
+
+@app.post("/sync/sheets")
+def sync_sheets(background_tasks: BackgroundTasks, full: bool = False):
+    """
+    Pulls new Event_Master / Attendance_Logs rows from Google Sheets.
+    Incremental by default; full=true re-reads both worksheets.
+    """
+    background_tasks.add_task(run_sheets_sync, not full)
+    return {"message": "Sheets sync started", "incremental": not full}
+
+@app.post("/sync/export")
+def export_to_sheets(background_tasks: BackgroundTasks, full: bool = False):
+    """
+    Writes Event_Strength and Attendance to Google Sheets from the DB.
+    Only rows affected since the last export unless full=true.
+    """
+    background_tasks.add_task(run_sheets_export, full)
+    return {"message": "Sheets export started", "full": full}
+
 @app.get("/")
 def read_root():
     return {"message": "Face Attendance API is running"}
 
+@app.get("/metrics")
+def metrics():
+    GALLERY_SIZE.set(len(gallery))
+    if attendance_journal:
+        JOURNAL_BACKLOG.set(attendance_journal.backlog())
+        JOURNAL_REJECTED.set(attendance_journal.rejected_count())
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+@app.get("/health/live")
+def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def health_ready():
+    """
+    Ready once the DB answers. Recognition is reported separately since it
+    keeps warming up in the background after the API is serving.
+    """
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        print(f"Readiness check failed: {e}")
+        raise HTTPException(status_code=503, detail="Database unavailable")
+
+    return {
+        "status": "ready",
+        "recognition": "ready" if recognition_ready.is_set() else ("failed" if recognition_error else "warming_up"),
+        "attendance_backlog": attendance_journal.backlog() if attendance_journal else None,
+        "attendance_rejected": attendance_journal.rejected_count() if attendance_journal else None
+    }
+
+def parse_face_location(value, image):
+    """
+    Parses a client-side face box "top,right,bottom,left" (pixels, the
+    face_recognition order) and clamps it to the image.
+    """
+    try:
+        top, right, bottom, left = (int(round(float(v))) for v in value.split(","))
+    except (ValueError, OverflowError): # OverflowError: inf
+        raise HTTPException(status_code=400, detail="face_location must be 'top,right,bottom,left'")
+    height, width = image.shape[:2]
+    top, left = max(top, 0), max(left, 0)
+    bottom, right = min(bottom, height), min(right, width)
+    if bottom <= top or right <= left:
+        raise HTTPException(status_code=400, detail="face_location is outside the image")
+    return (top, right, bottom, left)
+
+def encode_faces(image, endpoint, timer, face_location=None, cropped=False):
+    """
+    Returns (encodings, detection). Detection is skipped when the client
+    already localized the face: either a face_location box or a tightly
+    cropped face (cropped=true, the whole image is the face).
+    """
+    config = DETECTION[endpoint]
+    if face_location:
+        locations, detection = [parse_face_location(face_location, image)], "client_box"
+    elif cropped:
+        height, width = image.shape[:2]
+        locations, detection = [(0, width, height, 0)], "cropped"
+    else:
+        with timer.stage("detect"):
+            locations = face_recognition.face_locations(
+                image, number_of_times_to_upsample=config["upsample"], model=config["model"])
+        detection = config["model"]
+    with timer.stage("encode"):
+        encodings = face_recognition.face_encodings(
+            image, known_face_locations=locations, num_jitters=config["jitters"])
+    return encodings, detection
+
+def cached_encode_faces(path, data, endpoint, timer, face_location=None, cropped=False):
+    """
+    encode_faces behind the frame cache, keyed by the upload's content and
+    the detection settings. Returns (encodings, detection); detection is
+    "cache" when dlib was skipped.
+    """
+    config = DETECTION[endpoint]
+    key = (content_hash(data), (config["model"], config["upsample"], config["jitters"], face_location, cropped))
+    encodings = frame_cache.get(key)
+    phash = None
+    if encodings is None and frame_cache.uses_phash and endpoint in PHASH_ENDPOINTS:
+        with timer.stage("phash"):
+            phash = perceptual_hash(path)
+        encodings = frame_cache.get(key, phash)
+    if encodings is not None:
+        FRAME_CACHE_LOOKUPS.labels(endpoint, "hit").inc()
+        return encodings, "cache"
+    FRAME_CACHE_LOOKUPS.labels(endpoint, "miss").inc()
+
+    with timer.stage("decode"):
+        image = face_recognition.load_image_file(path)
+    encodings, detection = encode_faces(image, endpoint, timer, face_location, cropped)
+    frame_cache.put(key, encodings, phash)
+    return encodings, detection
+
 @app.post("/register")
-async def register_user(name: str = Form(...), regimental_number: str = Form(...), file: UploadFile = File(...)):
-    global known_data
+async def register_user(
+    name: str = Form(...),
+    regimental_number: str = Form(...),
+    file: UploadFile = File(...),
+    face_location: str = Form(None),
+    cropped: bool = Form(False)
+):
+    require_recognition()
+    timer = StageTimer("register")
     
     temp_filename = f"temp_{file.filename}"
-    with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    with timer.stage("upload_copy"):
+        data = file.file.read()
+        with open(temp_filename, "wb") as buffer:
+            buffer.write(data)
     
     try:
-        image = face_recognition.load_image_file(temp_filename)
-        encodings = face_recognition.face_encodings(image)
+        encodings, detection = cached_encode_faces(temp_filename, data, "register", timer, face_location, cropped)
         
         if not encodings:
-            os.remove(temp_filename)
+            logger.info("register", extra={"fields": {"reg_no": regimental_number, "result": "no_face", "detection": detection, **timer.timings}})
             raise HTTPException(status_code=400, detail="No face found in image")
             
         encoding = encodings[0]
+
+        duplicate = gallery.match(encoding, tolerance=REGISTER_DUPLICATE_DISTANCE)
+        if duplicate is not None:
+            index, distance = duplicate
+            if gallery.reg_nos[index] != regimental_number:
+                logger.info("register", extra={"fields": {"reg_no": regimental_number, "result": "conflict", "existing_reg_no": gallery.reg_nos[index], "distance": distance, **timer.timings}})
+                raise HTTPException(status_code=409, detail=f"This face is already registered as {gallery.names[index]} ({gallery.reg_nos[index]})")
+            logger.info("register", extra={"fields": {"reg_no": regimental_number, "result": "duplicate", "distance": distance, **timer.timings}})
+            return {"message": f"{name} ({regimental_number}) is already registered with this photo", "duplicate": True}
         
-        known_data["encodings"].append(encoding)
-        known_data["names"].append(name)
-        known_data["reg_nos"].append(regimental_number)
-        
-        with open(ENCODINGS_FILE, "wb") as f:
-            pickle.dump(known_data, f)
-            
-        return {"message": f"Successfully registered {name} ({regimental_number})"}
+        with timer.stage("persist"):
+            gallery.add(encoding, name, regimental_number)
+
+        logger.info("register", extra={"fields": {"reg_no": regimental_number, "result": "registered", "detection": detection, "gallery_size": len(gallery), **timer.timings}})
+        return {"message": f"Successfully registered {name} ({regimental_number})", "duplicate": False}
         
+    except HTTPException:
+        raise
     except Exception as e:
+        logger.exception("register failed", extra={"fields": {"reg_no": regimental_number, **timer.timings}})
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if os.path.exists(temp_filename):
@@ -108,25 +354,14 @@ async def register_user(name: str = Form(...), regimental_number: str = Form(...
 
 # --- Drive Integration for Image Upload ---
 
-def get_drive_service():
-    if not os.path.exists(CREDENTIALS_FILE):
-        return None
-    try:
-        scope = ['https://www.googleapis.com/auth/drive.file'] 
-        creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
-        service = build('drive', 'v3', credentials=creds)
-        return service
-    except Exception as e:
-        print(f"Error creating Drive service: {e}")
-        return None
-
 def create_or_get_folder(service, folder_name, parent_id=None):
+    from google_clients import with_retry
     query = f"mimeType='application/vnd.google-apps.folder' and name='{folder_name}' and trashed=false"
     if parent_id:
         query += f" and '{parent_id}' in parents"
     
     try:
-        results = service.files().list(q=query, fields="files(id, name)").execute()
+        results = with_retry(service.files().list(q=query, fields="files(id, name)").execute)
         files = results.get('files', [])
         
         if files:
@@ -140,13 +375,15 @@ def create_or_get_folder(service, folder_name, parent_id=None):
         if parent_id:
             file_metadata['parents'] = [parent_id]
             
-        file = service.files().create(body=file_metadata, fields='id').execute()
+        file = with_retry(service.files().create(body=file_metadata, fields='id').execute)
         return file.get('id')
     except Exception as e:
         print(f"Error creating/getting folder {folder_name}: {e}")
         return None
 
 def upload_image_to_drive(image_path, filename):
+    from googleapiclient.http import MediaFileUpload
+    from google_clients import get_drive_service, with_retry
     service = get_drive_service()
     if not service:
         return
@@ -173,83 +410,107 @@ def upload_image_to_drive(image_path, filename):
         }
         media = MediaFileUpload(image_path, mimetype='image/jpeg')
         
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        file = with_retry(service.files().create(body=file_metadata, media_body=media, fields='id').execute)
         print(f"Uploaded {filename} to Drive (ID: {file.get('id')})")
         
     except Exception as e:
         print(f"Error uploading to Drive: {e}")
 
 @app.post("/recognize")
-async def recognize_face(file: UploadFile = File(...), background_tasks: BackgroundTasks = BackgroundTasks()):
-    print("--- RECOGNIZE ENDPOINT CALLED ---")
-    global known_data
+async def recognize_face(
+    file: UploadFile = File(...),
+    background_tasks: BackgroundTasks = BackgroundTasks(),
+    event_id: str = Form(None),
+    status: str = Form("Present"),
+    face_location: str = Form(None),
+    cropped: bool = Form(False)
+):
+    """
+    Identifies the face. With an event_id, a match is also marked present
+    for that event (journaled like /log_attendance). Clients that detect
+    faces themselves can pass face_location or cropped=true to skip detection.
+    """
+    require_recognition()
+    timer = StageTimer("recognize")
     
     try:
-        if not known_data:
-            print("known_data is None or empty structure")
-            known_data = {"encodings": [], "names": [], "reg_nos": []}
-
-        print(f"Known faces count: {len(known_data.get('encodings', []))}")
-
-        if not known_data.get("encodings"):
-             print("No encodings, returning early.")
+        if not len(gallery):
+             RECOGNITION_RESULTS.labels("empty_gallery").inc()
+             logger.info("recognize", extra={"fields": {"result": "empty_gallery"}})
              return {"name": "Unknown", "reg_no": "", "match": False, "detail": "No registered faces"}
         
         # Generate unique filename for upload
         timestamp = datetime.now().strftime("%H-%M-%S")
         original_filename = file.filename
         temp_filename = f"temp_rec_{timestamp}_{original_filename}"
-        print(f"Saving temp file: {temp_filename}")
         
-        with open(temp_filename, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        with timer.stage("upload_copy"):
+            data = file.file.read()
+            with open(temp_filename, "wb") as buffer:
+                buffer.write(data)
             
-        print("File saved. Loading image...")
-        image = face_recognition.load_image_file(temp_filename)
-        print("Image loaded. Generating encodings...")
-        encodings = face_recognition.face_encodings(image)
-        print(f"Encodings found: {len(encodings)}")
+        encodings, detection = cached_encode_faces(temp_filename, data, "recognize", timer, face_location, cropped)
         
         if not encodings:
             if os.path.exists(temp_filename): os.remove(temp_filename)
+            RECOGNITION_RESULTS.labels("no_face").inc()
+            logger.info("recognize", extra={"fields": {"result": "no_face", "detection": detection, **timer.timings}})
             return {"name": "Unknown", "reg_no": "", "match": False, "detail": "No face detected"}
             
         unknown_encoding = encodings[0]
-        matches = face_recognition.compare_faces(known_data["encodings"], unknown_encoding)
         name = "Unknown"
         reg_no = ""
         
-        face_distances = face_recognition.face_distance(known_data["encodings"], unknown_encoding)
-        if len(face_distances) > 0:
-            best_match_index = np.argmin(face_distances)
-            if matches[best_match_index]:
-                name = known_data["names"][best_match_index]
-                if "reg_nos" in known_data and len(known_data["reg_nos"]) > best_match_index:
-                     reg_no = known_data["reg_nos"][best_match_index]
+        with timer.stage("match"):
+            best = gallery.match(unknown_encoding)
+            if best is not None:
+                best_match_index, distance = best
+                name = gallery.names[best_match_index]
+                reg_no = gallery.reg_nos[best_match_index]
         
-        print(f"Match result: {name}")
         already_marked = False
+        queued = False
+        if event_id and reg_no:
+            with timer.stage("mark"):
+                try:
+                    # Journal I/O off the event loop
+                    new, queued = await run_in_threadpool(attendance_journal.mark, event_id, reg_no, status)
+                except UnknownCadetOrEvent as e:
+                    raise HTTPException(status_code=400, detail=f"Unknown cadet or event: {e}")
+                already_marked = not new
         
         # Trigger background upload
         upload_name = f"{name}_{timestamp}.jpg"
         
         def background_upload_and_clean(path, fname):
-            print(f"Background upload starting: {fname}")
+            start = time.perf_counter()
             try:
                 upload_image_to_drive(path, fname)
-            except Exception as bg_e:
-                print(f"Background upload failed: {bg_e}")
+            except Exception:
+                logger.exception("background upload failed", extra={"fields": {"file": fname}})
+            finally:
+                BACKGROUND_QUEUE_DEPTH.dec()
+                STAGE_SECONDS.labels("recognize", "drive_upload").observe(time.perf_counter() - start)
             if os.path.exists(path):
                 os.remove(path)
                 
+        BACKGROUND_QUEUE_DEPTH.inc()
         background_tasks.add_task(background_upload_and_clean, temp_filename, upload_name)
+
+        RECOGNITION_RESULTS.labels("match" if name != "Unknown" else "unknown").inc()
+        logger.info("recognize", extra={"fields": {
+            "result": "match" if name != "Unknown" else "unknown", "reg_no": reg_no,
+            "faces": len(encodings), "detection": detection, "gallery_size": len(gallery),
+            "db_queries": current_db_stats()["queries"], **timer.timings
+        }})
+        return {"name": name, "reg_no": reg_no, "match": name != "Unknown", "already_marked": already_marked, "queued": queued}
         
-        return {"name": name, "reg_no": reg_no, "match": name != "Unknown", "already_marked": already_marked}
-        
+    except HTTPException:
+        if 'temp_filename' in locals() and os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
     except Exception as e:
-        print(f"Error during recognition: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("recognition failed", extra={"fields": timer.timings})
         if 'temp_filename' in locals() and os.path.exists(temp_filename): 
             os.remove(temp_filename)
         raise HTTPException(status_code=500, detail=str(e))
@@ -276,36 +537,21 @@ def log_attendance(
     name: str = Form(...),
     reg_no: str = Form(...),
     event_id: str = Form(...),
-    status: str = Form(...),
-    db: Session = Depends(get_db)
+    status: str = Form(...)
 ):
     """
-    Logs a single attendance record to DB.
+    Logs a single attendance record. Written to the local journal and
+    flushed to the DB in the background (queued=true until then), so it
+    never waits on Postgres.
     """
-    print(f"--- LOG ATTENDANCE CALLED ---")
-    print(f"Name: {name}, RegNo: {reg_no}, EventID: {event_id}, Status: {status}")
     try:
-        # Check duplicate
-        existing = db.query(models.AttendanceLog).filter(
-            models.AttendanceLog.event_id == event_id,
-            models.AttendanceLog.enrollment_id == reg_no
-        ).first()
-        
-        if existing:
-             return {"message": "Already marked", "duplicate": True}
-
-        new_log = models.AttendanceLog(
-            event_id=event_id,
-            enrollment_id=reg_no,
-            status=status,
-            timestamp=datetime.now()
-        )
-        
-        db.add(new_log)
-        db.commit()
-        
-        return {"message": "Attendance logged successfully", "duplicate": False}
+        new, queued = attendance_journal.mark(event_id, reg_no, status)
+        if not new:
+            return {"message": "Already marked", "duplicate": True, "queued": queued}
+        return {"message": "Attendance logged successfully", "duplicate": False, "queued": queued}
         
+    except UnknownCadetOrEvent as e:
+        raise HTTPException(status_code=400, detail=f"Unknown cadet or event: {e}")
     except Exception as e:
         print(f"Error logging attendance: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -418,7 +664,7 @@ async def get_events(limit: int = 5, db: Session = Depends(get_db)):
         result = []
         for ev in events:
             # Count attendance
-            count = db.query(models.AttendanceLog).filter(models.AttendanceLog.event_id == ev.event_id).count()
+            count = db.query(models.AttendanceLogAll).filter(models.AttendanceLogAll.event_id == ev.event_id).count()
             
             result.append({
                 "id": ev.event_id,
@@ -515,7 +761,7 @@ def get_event_details(event_id: str, db: Session = Depends(get_db)):
         if not event:
             raise HTTPException(status_code=404, detail="Event not found")
             
-        count = db.query(models.AttendanceLog).filter(models.AttendanceLog.event_id == event_id).count()
+        count = db.query(models.AttendanceLogAll).filter(models.AttendanceLogAll.event_id == event_id).count()
         total_strength = db.query(models.Cadet).count()
         
         return {
@@ -542,7 +788,8 @@ def get_event_attendance(event_id: str, db: Session = Depends(get_db)):
         cadets = db.query(models.Cadet).all()
         
         # Fetch logs for this event
-        logs = db.query(models.AttendanceLog).filter(models.AttendanceLog.event_id == event_id).all()
+        # Past events may have been archived: read logs through attendance_logs_all
+        logs = db.query(models.AttendanceLogAll).filter(models.AttendanceLogAll.event_id == event_id).all()
         log_map = {log.enrollment_id: log.status for log in logs}
         
         result = []
@@ -569,9 +816,9 @@ def get_event_ods(event_id: str, db: Session = Depends(get_db)):
     Fetches OD list for a specific event (Status != 'Present').
     """
     try:
-        logs = db.query(models.AttendanceLog).filter(
-            models.AttendanceLog.event_id == event_id,
-            models.AttendanceLog.status != "Present"
+        logs = db.query(models.AttendanceLogAll).filter(
+            models.AttendanceLogAll.event_id == event_id,
+            models.AttendanceLogAll.status != "Present"
         ).all()
         
         result = []
@@ -605,10 +852,13 @@ async def get_recent_events_endpoint(limit: int = 5, db: Session = Depends(get_d
     return await get_events(limit, db)
 
 @app.get("/attendance-summary")
-def get_attendance_summary(db: Session = Depends(get_db)):
+def get_attendance_summary(term: Optional[str] = None, db: Session = Depends(get_db)):
     """
-    aggregated attendance for each cadet.
+    aggregated attendance for each cadet, current term. With term
+    (e.g. '2024-25') the counts of that past term instead.
     """
+    if term and term != archive_attendance.term_for(date.today()):
+        return get_term_summary(term, db)
     try:
         # Fetch from the View which already has aggregated data
         summary = db.query(models.AttendanceSummary).all()
@@ -636,7 +886,145 @@ def get_attendance_summary(db: Session = Depends(get_db)):
         print(f"Error fetching attendance summary: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# Keep Login using GSpread as User table is not migrated
+def term_range(term):
+    """
+    First and last day of a term name like '2024-25'; 400 if malformed.
+    """
+    if not re.fullmatch(r"\d{4}-\d{2}", term):
+        raise HTTPException(status_code=400, detail="term must look like '2024-25'")
+    start, end = archive_attendance.term_bounds(term)
+    return start, end - timedelta(days=1)
+
+def get_term_summary(term, db):
+    """
+    /attendance-summary rows of a past term, from attendance_term_rollups
+    once archived, else computed from its logs (still in attendance_logs).
+    """
+    start, end = term_range(term)
+    try:
+        rows = db.query(models.AttendanceTermRollup, models.Cadet).outerjoin(
+            models.Cadet, models.Cadet.enrollment_id == models.AttendanceTermRollup.enrollment_id
+        ).filter(models.AttendanceTermRollup.term == term) \
+         .order_by(models.AttendanceTermRollup.enrollment_id).all()
+        if not rows:
+            import attendance_export
+            summary = attendance_export.build_summary(attendance_export.fetch_matrix(db, start, end))
+            return summary.astype(object).where(summary.notna(), None).to_dict("records")
+
+        result = []
+        for i, (r, cadet) in enumerate(rows):
+            result.append({
+                "Sr No": i + 1,
+                "Enrollment ID": r.enrollment_id,
+                "RANK": cadet.rank if cadet else None,
+                "Year": cadet.year if cadet else None,
+                "Name": cadet.name if cadet else None,
+                "DEPT": cadet.department if cadet else None,
+                "PU ROLL NUMBER": cadet.pu_roll_number if cadet else None,
+                "Mandatory Parade": r.mandatory_parade or 0,
+                "Social Drives": r.social_drives or 0,
+                "College Events": r.college_events or 0,
+                "Others": r.others or 0,
+                "Total": r.total or 0
+            })
+
+        return result
+
+    except Exception as e:
+        print(f"Error fetching term summary: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+def export_response(sheet_title, chunks, format, filename):
+    import attendance_export
+    if format == "csv":
+        body = attendance_export.stream_csv(chunks)
+    else:
+        body = attendance_export.stream_file(attendance_export.write_xlsx(chunks, sheet_title))
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[format], headers={
+        "Content-Disposition": f'attachment; filename="{filename}.{format}"'
+    })
+
+def export_range(term, start, end):
+    """
+    Event date range of an export: start/end when given, else the term's
+    bounds; the current term by default, like /attendance-summary.
+    """
+    if not (start or end):
+        start, end = term_range(term or archive_attendance.term_for(date.today()))
+    elif term:
+        term_start, term_end = term_range(term)
+        start, end = start or term_start, end or term_end
+    return start, end
+
+def fetch_export_matrix(db, format, start, end, year, category):
+    import attendance_export
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_MEDIA_TYPES)}")
+    if category and category not in attendance_export.CATEGORY_KEYS:
+        raise HTTPException(status_code=400, detail=f"category must be one of {', '.join(attendance_export.CATEGORY_KEYS)}")
+    return attendance_export.fetch_matrix(db, start, end, year, category)
+
+@app.get("/export/attendance-matrix")
+def export_attendance_matrix(
+    format: str = "xlsx",
+    term: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    year: Optional[str] = None,
+    category: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Cadet x event matrix (status per cell) as CSV or XLSX, filtered by
+    term or event date range (current term by default), cadet year and
+    event category.
+    """
+    import attendance_export
+    try:
+        start, end = export_range(term, start, end)
+        matrix = fetch_export_matrix(db, format, start, end, year, category)
+        chunks = attendance_export.matrix_chunks(matrix)
+        filename = attendance_export.export_filename("attendance_matrix", start, end, year, category)
+        return export_response("Attendance Matrix", chunks, format, filename)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error exporting attendance matrix: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/export/attendance-summary")
+def export_attendance_summary(
+    format: str = "xlsx",
+    term: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    year: Optional[str] = None,
+    category: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    The /attendance-summary category counts as CSV or XLSX, computed over
+    the filtered events (current term by default, like /attendance-summary).
+    """
+    import attendance_export
+    try:
+        start, end = export_range(term, start, end)
+        matrix = fetch_export_matrix(db, format, start, end, year, category)
+        chunks = attendance_export.summary_chunks(attendance_export.build_summary(matrix))
+        filename = attendance_export.export_filename("attendance_summary", start, end, year, category)
+        return export_response("Attendance Summary", chunks, format, filename)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error exporting attendance summary: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Login is served from the cached credential store (mirrored from the 'Credentials' sheet)
 class LoginRequest(BaseModel):
     username: str
     password: str
@@ -644,39 +1032,18 @@ class LoginRequest(BaseModel):
 @app.post("/login")
 def login(login_data: LoginRequest):
     """
-    Verifies username and password against 'Credentials' sheet.
+    Verifies username and password against the cached 'Credentials' sheet.
     """
-    if not os.path.exists(CREDENTIALS_FILE):
-        raise HTTPException(status_code=500, detail="Credentials file not found")
-
-    SHEET_ID = '11yk2xohYru3MyqqnXzTYBIr3lFkWbXsVOP2P7PRDbfE'
-    
-    try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
-        client = gspread.authorize(creds)
-        
-        spreadsheet = client.open_by_key(SHEET_ID)
+    if not len(credential_store):
+        # Nothing cached yet (first run); fetch synchronously once
         try:
-            worksheet = spreadsheet.worksheet("Credentials")
-        except gspread.exceptions.WorksheetNotFound:
-            raise HTTPException(status_code=500, detail="Credentials sheet not found")
-            
-        records = worksheet.get_all_records()
-        
-        for user in records:
-            if str(user.get("Username")) == login_data.username and str(user.get("Password")) == login_data.password:
-                return {
-                    "success": True,
-                    "role": user.get("Role"),
-                    "name": user.get("Name"),
-                    "username": user.get("Username")
-                }
-                
+            credential_store.refresh_from_sheet()
+        except Exception as e:
+            print(f"Error loading credentials: {e}")
+            raise HTTPException(status_code=503, detail="Credentials unavailable")
+
+    user = credential_store.verify(login_data.username, login_data.password)
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    except HTTPException as he:
-        raise he
-    except Exception as e:
-        print(f"Error logging in: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return {"success": True, **user}
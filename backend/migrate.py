@@ -0,0 +1,55 @@
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+import time
+from database import engine
+import models
+from create_view import create_attendance_summary_view, create_attendance_logs_all_view
+
+# Explicit schema step, run once per deploy (the 'migrate' compose service)
+# instead of on every API import.
+
+def ensure_attendance_unique_key():
+    # Tables created before the constraint existed: drop duplicate marks
+    # (keeping the earliest) and add the unique index
+    with engine.begin() as conn:
+        conn.execute(text("""
+            DELETE FROM attendance_logs a
+            USING attendance_logs b
+            WHERE a.event_id = b.event_id
+              AND a.enrollment_id = b.enrollment_id
+              AND a.id > b.id
+        """))
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_event_cadet "
+            "ON attendance_logs (event_id, enrollment_id)"
+        ))
+
+CONNECT_ATTEMPTS = 30 # ~1 minute for Postgres to accept connections
+
+def wait_for_db():
+    for attempt in range(CONNECT_ATTEMPTS):
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return
+        except OperationalError as e:
+            if attempt == CONNECT_ATTEMPTS - 1:
+                raise
+            print(f"Database not ready ({e.orig}), retrying...")
+            time.sleep(2)
+
+def migrate():
+    wait_for_db()
+    print("--- Creating tables (if not exist) ---")
+    # Views (see create_view.py) are mapped too but aren't tables
+    views = {models.AttendanceSummary.__tablename__, models.AttendanceLogAll.__tablename__}
+    tables = [t for t in models.Base.metadata.sorted_tables if t.name not in views]
+    models.Base.metadata.create_all(bind=engine, tables=tables)
+    print("--- Ensuring one attendance mark per cadet per event ---")
+    ensure_attendance_unique_key()
+    print("--- Creating views ---")
+    create_attendance_summary_view()
+    create_attendance_logs_all_view()
+
+if __name__ == "__main__":
+    migrate()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, Time, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, Time, DateTime, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -33,6 +33,8 @@ class Event(Base):
 
 class AttendanceLog(Base):
     __tablename__ = "attendance_logs"
+    # One mark per cadet per event; lets journal flushes upsert idempotently
+    __table_args__ = (UniqueConstraint("event_id", "enrollment_id", name="uq_attendance_event_cadet"),)
 
     id = Column(Integer, primary_key=True, index=True)
     event_id = Column(String, ForeignKey("events.event_id"))
@@ -43,6 +45,40 @@ class AttendanceLog(Base):
     event = relationship("Event", back_populates="attendance_logs")
     cadet = relationship("Cadet")
 
+class AttendanceLogArchive(Base):
+    __tablename__ = "attendance_logs_archive"
+    __table_args__ = (UniqueConstraint("event_id", "enrollment_id", name="uq_attendance_archive_event_cadet"),)
+
+    # Logs of closed terms, moved out of attendance_logs by archive_attendance.py
+    id = Column(Integer, primary_key=True) # id the row had in attendance_logs
+    event_id = Column(String)
+    enrollment_id = Column(String)
+    status = Column(String)
+    timestamp = Column(DateTime)
+    term = Column(String, index=True) # e.g. '2024-25'
+
+class AttendanceTermRollup(Base):
+    __tablename__ = "attendance_term_rollups"
+
+    # attendance_summary_view counts per cadet for an archived term
+    term = Column(String, primary_key=True)
+    enrollment_id = Column(String, primary_key=True)
+    mandatory_parade = Column(Integer)
+    social_drives = Column(Integer)
+    college_events = Column(Integer)
+    others = Column(Integer)
+    total = Column(Integer)
+
+class AttendanceLogAll(Base):
+    __tablename__ = "attendance_logs_all"
+
+    # Read-only view: attendance_logs UNION ALL attendance_logs_archive (see create_view.py)
+    id = Column(Integer, primary_key=True)
+    event_id = Column(String)
+    enrollment_id = Column(String)
+    status = Column(String)
+    timestamp = Column(DateTime)
+
 class AttendanceSummary(Base):
     __tablename__ = 'attendance_summary_view'
     
@@ -59,3 +95,20 @@ class AttendanceSummary(Base):
     college_events = Column(Integer)
     others = Column(Integer)
     total = Column(Integer)
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+
+    name = Column(String, primary_key=True) # e.g. worksheet name
+    position = Column(Integer, default=0) # rows already processed
+    updated_at = Column(DateTime, default=datetime.now)
+
+class User(Base):
+    __tablename__ = "users"
+
+    # Mirrored from the 'Credentials' sheet; passwords are stored hashed only
+    username = Column(String, primary_key=True, index=True)
+    name = Column(String)
+    role = Column(String)
+    salt = Column(String) # hex
+    password_hash = Column(String) # hex PBKDF2-SHA256
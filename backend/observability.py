@@ -0,0 +1,138 @@
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import event
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import os
+import time
+
+# Prometheus metrics, per-stage timers and JSON logging for the API.
+# Scraped from GET /metrics.
+#
+# With several uvicorn workers each process has its own registry, so a
+# scrape would only see whichever worker answered. Setting
+# PROMETHEUS_MULTIPROC_DIR (an empty directory, cleared before the workers
+# start; see the Dockerfile) makes every worker write its samples there and
+# /metrics aggregates all of them. Gauges are set at scrape time rather than
+# via set_function, which multiprocess mode doesn't support.
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"])
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_duration_seconds", "Recognition/registration stage latency", ["endpoint", "stage"],
+    buckets=STAGE_BUCKETS)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Duration of individual SQL statements", buckets=STAGE_BUCKETS)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "SQL statements issued per request", ["route"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250))
+DB_SECONDS_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds", "Total SQL time per request", ["route"], buckets=STAGE_BUCKETS)
+RECOGNITION_RESULTS = Counter(
+    "recognition_results_total", "Recognition outcomes", ["result"])
+BACKGROUND_QUEUE_DEPTH = Gauge(
+    "background_tasks_pending", "Background tasks (Drive uploads) not yet finished", multiprocess_mode="sum")
+GALLERY_SIZE = Gauge(
+    "gallery_size", "Registered face encodings held in memory", multiprocess_mode="mostrecent")
+FRAME_CACHE_LOOKUPS = Counter(
+    "frame_cache_lookups_total", "Encoding cache lookups for uploaded frames", ["endpoint", "result"])
+JOURNAL_BACKLOG = Gauge(
+    "attendance_journal_backlog", "Attendance marks journaled locally but not yet flushed to the DB",
+    multiprocess_mode="mostrecent")
+JOURNAL_REJECTED = Gauge(
+    "attendance_journal_rejected", "Journaled attendance marks the DB refused (unknown cadet or event)",
+    multiprocess_mode="mostrecent")
+
+_db_stats = contextvars.ContextVar("db_stats", default=None)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def get_logger(name="attendance"):
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+class StageTimer:
+    """
+    Times named stages of one request into STAGE_SECONDS and keeps the
+    durations (ms) for the request's log line.
+    """
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            STAGE_SECONDS.labels(self.endpoint, name).observe(elapsed)
+            self.timings[f"{name}_ms"] = round(elapsed * 1000, 2)
+
+def instrument_engine(engine):
+    """
+    Records every statement's duration, and per-request count/time when
+    called inside a request (see metrics_middleware).
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERY_SECONDS.observe(elapsed)
+        stats = _db_stats.get()
+        if stats is not None:
+            stats["queries"] += 1
+            stats["seconds"] += elapsed
+
+def current_db_stats():
+    return _db_stats.get() or {"queries": 0, "seconds": 0.0}
+
+async def metrics_middleware(request, call_next):
+    stats = {"queries": 0, "seconds": 0.0}
+    token = _db_stats.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        _db_stats.reset(token)
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        REQUEST_SECONDS.labels(request.method, route, str(status)).observe(time.perf_counter() - start)
+        DB_QUERIES_PER_REQUEST.labels(route).observe(stats["queries"])
+        DB_SECONDS_PER_REQUEST.labels(route).observe(stats["seconds"])
+
+def metrics_payload():
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,26 +1,21 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import os
+import sys
 
-CREDENTIALS_FILE = 'data/credentials.json'
-SHEET_ID = '11yk2xohYru3MyqqnXzTYBIr3lFkWbXsVOP2P7PRDbfE'
+# Run from backend/ (data/credentials.json is relative to it)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from google_clients import credentials_available, get_worksheet, with_retry
 
 def check_headers():
-    if not os.path.exists(CREDENTIALS_FILE):
+    if not credentials_available():
         print("Credentials file not found")
         return
 
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
-    client = gspread.authorize(creds)
-    spreadsheet = client.open_by_key(SHEET_ID)
-    
     try:
-        od_ws = spreadsheet.worksheet("OD_List")
-        headers = od_ws.row_values(1)
+        od_ws = get_worksheet("OD_List")
+        headers = with_retry(od_ws.row_values, 1)
         print("Headers found in OD_List:", headers)
         
-        records = od_ws.get_all_records()
+        records = with_retry(od_ws.get_all_records)
         if records:
             print("First record keys:", list(records[0].keys()))
         else: